@@ -1,6 +1,7 @@
 import os
 import shutil
-from flask import Flask, request, send_file, jsonify
+import threading
+from flask import Flask, request, send_file, jsonify, make_response
 from werkzeug.utils import secure_filename
 from flask_cors import CORS
 
@@ -10,14 +11,17 @@ from random import random
 from PIL import Image
 import glob
 
-from modules.detect_boulders import detect_boulders
-from modules.cluster_boulders import cluster_boulders
-from modules.generate_stats import generate_stats
-from modules.generate_heatmap import generate_heatmap
-from modules.estimate_source import estimate_source
-from modules.generate_pdf_report import generate_pdf
-from modules.generate_heatmap_json import generate_heatmap_json
-from modules.detect_landslides import detect_landslides
+from modules.pipeline import analysis_stages, run_pipeline
+from modules.incremental_analysis import detect_incremental
+from modules.job_store import (
+    new_job_id, job_exists, job_path, save_job, write_status, read_status, set_current_job, current_job
+)
+from modules.quicklook import quicklook_stages
+from modules.refilter_boulders import parse_thresholds, refilter_boulders
+from modules.memory_budget import MemoryMonitor, plan_analysis
+from modules.tile_pyramid import PYRAMID_IMAGES, image_version, pyramid_info, render_tile
+from modules.tiff_reader import is_tiff
+from modules.tiff_ingest import open_tiff, write_preview
 
 # App Initialization
 app = Flask(__name__)
@@ -28,6 +32,10 @@ app.config['STATIC_FOLDER'] = 'static'
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['STATIC_FOLDER'], exist_ok=True)
 
+# Guards the static folder. It is per process, which covers the app as long as
+# gunicorn runs its default single worker (see Procfile)
+analysis_lock = threading.Lock()
+
 def cleanup_previous_results():
     try:
         files_to_remove = [
@@ -40,7 +48,10 @@ def cleanup_previous_results():
             'report.pdf',
             'boulder_data_clustered.csv',
             'boulder_points.json',
-            'stats_summary.txt'
+            'stats_summary.txt',
+            'landslide_data.json',
+            'boulder_candidates.csv',
+            'change_report.json'
         ]
         for filename in files_to_remove:
             filepath = os.path.join(app.config['STATIC_FOLDER'], filename)
@@ -60,7 +71,7 @@ def cleanup_previous_results():
         print(f"[⚠️] Error during cleanup: {str(e)}")
 
 def convert_tif_to_jpg(image_path):
-    if image_path.lower().endswith('.tif'):
+    if is_tiff(image_path):
         try:
             img = Image.open(image_path)
             if img.mode != 'RGB':
@@ -78,10 +89,89 @@ def convert_tif_to_jpg(image_path):
 def home():
     return "✅ SOMA Backend is live!"
 
+def load_stats_text():
+    stats_file = os.path.join(app.config['STATIC_FOLDER'], 'stats_summary.txt')
+    if os.path.exists(stats_file):
+        with open(stats_file, 'r', encoding='utf-8') as f:
+            return f.read()
+    return ""
+
+def stage_summary(stages):
+    return {
+        name: {key: result[key] for key in ('status', 'seconds', 'error')}
+        for name, result in stages.items()
+    }
+
+def run_full_analysis(job_id, image_path, plan, reference_job=None, tiff_preview=None):
+    """
+    Runs the full-resolution pipeline, stores the job and records its status.
+    With `tiff_preview`, image_path is a TIFF read window by window and the job
+    keeps the preview (and its scale) instead of the full-resolution source.
+    """
+    with MemoryMonitor() as monitor:
+        change_report = None
+        if reference_job:
+            change_report = detect_incremental(image_path, reference_job)
+        stages = run_pipeline(
+            analysis_stages(image_path, detect=change_report is None, plan=plan, tiff_preview=tiff_preview),
+            max_workers=1 if plan['sequential'] else None
+        )
+    failed = [name for name, result in stages.items() if result['status'] != 'success']
+    memory = dict(
+        monitor.summary(),
+        budget_mb=plan['budget_mb'],
+        estimated_peak_mb=plan['estimated_peak_mb'],
+        plan={key: plan[key] for key in ('name', 'sequential', 'tiled', 'render_scale', 'plot_dpi', 'skip_optional')}
+    )
+    print(f"[🧠] Peak memory {memory['peak_mb']} MB (+{memory['job_peak_mb']} MB for this job)")
+    if tiff_preview:
+        save_job(job_id, tiff_preview['path'],
+                 extra={'memory': memory, 'source_is_preview': True, 'source_scale': tiff_preview['scale']})
+    else:
+        save_job(job_id, image_path, extra={'memory': memory})
+    print(f"[✅] Analysis pipeline completed ({len(failed)} stages failed or skipped)")
+
+    result = {
+        "status": "partial" if failed else "success",
+        "fidelity": "full",
+        "state": "complete",
+        "job_id": job_id,
+        "stages": stage_summary(stages),
+        "change_report": change_report,
+        "memory": memory,
+        "stats_summary": load_stats_text()
+    }
+    write_status(job_id, result)
+    return result
+
+def analysis_busy():
+    # Refusing instead of queueing keeps requests well inside gunicorn's worker timeout
+    running = current_job(app.config['STATIC_FOLDER'])
+    response = jsonify({
+        "error": "Another analysis is in progress, try again once it has finished.",
+        "running_job": running,
+        "status_url": f"/jobs/{running}" if running else None
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = '5'
+    return response
+
+def refine_in_background(job_id, image_path, plan, tiff_preview=None):
+    """
+    Replaces quick-look results with a full-resolution run, then releases
+    the analysis lock taken by the request that started it.
+    """
+    try:
+        run_full_analysis(job_id, image_path, plan, tiff_preview=tiff_preview)
+    except Exception as e:
+        print(f"[💥] Refinement Error: {str(e)}")
+        status = read_status(job_id) or {}
+        write_status(job_id, dict(status, state="failed", error=f"Refinement Error: {str(e)}"))
+    finally:
+        analysis_lock.release()
+
 @app.route('/analyze', methods=['POST'])
 def analyze():
-    cleanup_previous_results()
-
     if 'image' not in request.files:
         return jsonify({"error": "No file part in the request."}), 400
 
@@ -89,43 +179,87 @@ def analyze():
     if not file.filename:
         return jsonify({"error": "No file selected for upload."}), 400
 
+    # Optional: a previous job of the same site to re-analyse incrementally
+    reference_job = request.form.get('reference_job')
+    if reference_job and not job_exists(reference_job):
+        return jsonify({"error": f"Reference job not found: {reference_job}"}), 404
+
+    # Optional: 'quicklook' answers from a decimated image and refines in the background
+    mode = request.form.get('mode', 'full')
+    if mode not in ('full', 'quicklook'):
+        return jsonify({"error": f"Unknown mode: {mode}"}), 400
+
+    # Only one analysis may write to the static folder at a time
+    if not analysis_lock.acquire(blocking=False):
+        return analysis_busy()
+    handed_off = False
     try:
+        cleanup_previous_results()
+        job_id = new_job_id()
+        set_current_job(job_id, app.config['STATIC_FOLDER'])
+
         filename = secure_filename(file.filename)
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         file.save(filepath)
         print(f"[📁] Saved uploaded file: {filepath}")
 
-        processed_filepath = convert_tif_to_jpg(filepath)
-        if not processed_filepath:
-            return jsonify({"error": "Failed to process .tif image."}), 500
-
+        # Uncompressed TIFFs are read window by window; incremental runs need a decoded frame,
+        # so they are analysed in full instead
         preview_path = os.path.join(app.config['STATIC_FOLDER'], 'preview.jpg')
-        shutil.copy(processed_filepath, preview_path)
-        print(f"[🖼️] Created preview: {preview_path}")
-
-        print("[🔬] Starting analysis pipeline...")
-        detect_boulders(processed_filepath)
-        cluster_boulders()
-        generate_stats()
-        generate_heatmap()
-        estimate_source()
-        detect_landslides(processed_filepath)
-        generate_pdf()
-        generate_heatmap_json()
-        print("[✅] Analysis pipeline completed")
-
-        stats_text = ""
-        stats_file = os.path.join(app.config['STATIC_FOLDER'], 'stats_summary.txt')
-        if os.path.exists(stats_file):
-            with open(stats_file, 'r', encoding='utf-8') as f:
-                stats_text = f.read()
-            print("[📊] Loaded stats")
+        tiff = open_tiff(filepath) if is_tiff(filepath) else None
+        if tiff:
+            if reference_job:
+                print(f"[ℹ️] Windowed TIFF, running full analysis instead of comparing with job {reference_job}")
+                reference_job = None
+            tiff_preview = write_preview(tiff, preview_path)
+            processed_filepath = filepath
+        else:
+            tiff_preview = None
+            processed_filepath = convert_tif_to_jpg(filepath)
+            if not processed_filepath:
+                return jsonify({"error": "Failed to process .tif image."}), 500
+
+            shutil.copy(processed_filepath, preview_path)
+            print(f"[🖼️] Created preview: {preview_path}")
+
+        # Windowed detection is bounded by tile size, so the rest of the pipeline works at preview size
+        plan = plan_analysis(preview_path if tiff else processed_filepath,
+                             request.form.get('memory_budget_mb', type=int),
+                             incremental=bool(reference_job))
+
+        if mode == 'quicklook' and not reference_job:
+            print("[⚡] Starting quick-look pipeline...")
+            if tiff:
+                stages = run_pipeline(quicklook_stages(preview_path, full_width=tiff.width))
+            else:
+                stages = run_pipeline(quicklook_stages(processed_filepath))
+            failed = [name for name, result in stages.items() if result['status'] != 'success']
+            result = {
+                "status": "partial" if failed else "success",
+                "fidelity": "quicklook",
+                "state": "refining",
+                "job_id": job_id,
+                "decimation": stages['detect_boulders']['value'],
+                "stages": stage_summary(stages),
+                "stats_summary": load_stats_text()
+            }
+            write_status(job_id, result)
+
+            threading.Thread(
+                target=refine_in_background, args=(job_id, processed_filepath, plan, tiff_preview), daemon=True
+            ).start()
+            handed_off = True
+        else:
+            print("[🔬] Starting analysis pipeline...")
+            result = run_full_analysis(job_id, processed_filepath, plan, reference_job, tiff_preview)
 
         return jsonify({
-            "status": "success",
+            **result,
+            "status_url": f"/jobs/{job_id}",
             "preview_url": "/static/preview.jpg",
+            "heatmap_url": "/static/boulder_points.json",
+            "tiles": {name: f"/tiles/{name}/info.json" for name in PYRAMID_IMAGES},
             "report_url": "/download-report",
-            "stats_summary": stats_text,
             "random": random()
         })
 
@@ -133,6 +267,113 @@ def analyze():
         print(f"[💥] Pipeline Error: {str(e)}")
         return jsonify({"error": f"Pipeline Error: {str(e)}"}), 500
 
+    finally:
+        if not handed_off:
+            analysis_lock.release()
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    status = read_status(job_id)
+    if status is None:
+        return jsonify({"error": f"Job not found: {job_id}"}), 404
+    return jsonify(status)
+
+@app.route('/refilter', methods=['POST'])
+def refilter():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({"error": "Expected a JSON object."}), 400
+    job_id = payload.get('job_id')
+    if not isinstance(job_id, str) or not job_id:
+        return jsonify({"error": "job_id must be a non-empty string."}), 400
+    try:
+        thresholds = parse_thresholds(payload.get('thresholds'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Results are written to the static folder: refuse while an analysis (or its
+    # background refinement, whose job is only stored at the end) is running
+    if not analysis_lock.acquire(blocking=False):
+        return analysis_busy()
+    try:
+        if not job_exists(job_id):
+            return jsonify({"error": f"Job not found: {job_id}"}), 404
+        if not os.path.exists(job_path(job_id, 'boulder_candidates.csv')):
+            return jsonify({"error": "No candidate table stored for this job."}), 404
+        # The static folder only holds the latest analysis
+        if job_id != current_job(app.config['STATIC_FOLDER']):
+            return jsonify({"error": f"Only the latest analysis can be re-filtered, not job {job_id}."}), 409
+
+        result = refilter_boulders(job_id, thresholds, render=bool(payload.get('render')))
+
+        return jsonify({
+            "status": "success",
+            "job_id": job_id,
+            **result,
+            "stats_summary": load_stats_text(),
+            "random": random()
+        })
+
+    except Exception as e:
+        print(f"[💥] Re-filter Error: {str(e)}")
+        return jsonify({"error": f"Re-filter Error: {str(e)}"}), 500
+
+    finally:
+        analysis_lock.release()
+
+def pyramid_image_path(name):
+    if name not in PYRAMID_IMAGES:
+        return None
+    path = os.path.join(app.config['STATIC_FOLDER'], PYRAMID_IMAGES[name])
+    return path if os.path.exists(path) else None
+
+def tile_unavailable(name, error):
+    # The image is missing or half-written, typically while an analysis rewrites it
+    print(f"[⚠️] Tile image {name} unavailable: {str(error)}")
+    response = jsonify({"error": f"Image temporarily unavailable: {name}"})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+@app.route('/tiles/<name>/info.json')
+def tile_info(name):
+    path = pyramid_image_path(name)
+    if not path:
+        return jsonify({"error": f"Image not found: {name}"}), 404
+
+    try:
+        info = pyramid_info(name, path)
+    except (OSError, ValueError) as e:
+        return tile_unavailable(name, e)
+    response = jsonify(info)
+    response.set_etag(info['version'])
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@app.route('/tiles/<name>/<int:level>/<int:col>_<int:row>.jpg')
+def tile(name, level, col, row):
+    path = pyramid_image_path(name)
+    if not path:
+        return jsonify({"error": f"Image not found: {name}"}), 404
+
+    try:
+        version = image_version(path)
+        data = render_tile(path, version, level, col, row)
+    except (OSError, ValueError) as e:
+        return tile_unavailable(name, e)
+    if data is None:
+        return jsonify({"error": "Tile out of range."}), 404
+
+    response = make_response(data)
+    response.mimetype = 'image/jpeg'
+    response.set_etag(f"{version}-{level}-{col}-{row}")
+    # Versioned URLs never change content; unversioned ones must revalidate
+    if request.args.get('v') == version:
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
 @app.route('/download-report')
 def download_report():
     report_path = os.path.join(app.config['STATIC_FOLDER'], 'report.pdf')
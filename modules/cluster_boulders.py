@@ -1,6 +1,7 @@
-def cluster_boulders(df_path=None):
+def cluster_boulders(df_path=None, plot=True, dpi=300):
     """
     Clusters detected boulders based on their diameters and visualizes the results.
+    Pass plot=False to skip rendering the scatter plot, e.g. when re-filtering.
     """
     import pandas as pd
     import matplotlib
@@ -28,24 +29,33 @@ def cluster_boulders(df_path=None):
     # Step 4: KMeans clustering based on diameter
     X = df[['Diameter (m)']]
 
-    # Step 5: Handle compatibility for n_init
-    try:
-        kmeans = KMeans(n_clusters=3, random_state=0, n_init='auto')
-    except TypeError:
-        kmeans = KMeans(n_clusters=3, random_state=0, n_init=10)
+    # Step 5: Handle compatibility for n_init; strict thresholds can leave
+    # fewer distinct sizes than clusters, or no boulders at all
+    n_clusters = min(3, X['Diameter (m)'].nunique())
+    if n_clusters == 0:
+        df['Cluster'] = pd.Series(dtype=int)
+        df['SizeLabel'] = pd.Series(dtype=str)
+    else:
+        try:
+            kmeans = KMeans(n_clusters=n_clusters, random_state=0, n_init='auto')
+        except TypeError:
+            kmeans = KMeans(n_clusters=n_clusters, random_state=0, n_init=10)
 
-    df['Cluster'] = kmeans.fit_predict(X)
+        df['Cluster'] = kmeans.fit_predict(X)
 
-    # Step 6: Assign size labels based on cluster means
-    cluster_means = df.groupby("Cluster")["Diameter (m)"].mean().sort_values()
-    cluster_map = {i: label for i, label in zip(cluster_means.index, ['Small', 'Medium', 'Large'])}
-    df['SizeLabel'] = df['Cluster'].map(cluster_map)
+        # Step 6: Assign size labels based on cluster means
+        cluster_means = df.groupby("Cluster")["Diameter (m)"].mean().sort_values()
+        cluster_map = {i: label for i, label in zip(cluster_means.index, ['Small', 'Medium', 'Large'])}
+        df['SizeLabel'] = df['Cluster'].map(cluster_map)
 
     # Step 7: Save clustered data
     os.makedirs(os.path.dirname(output_file), exist_ok=True)
     df.to_csv(output_file, index=False)
     print(f"[✅] Clustered data saved to: {output_file}")
 
+    if not plot:
+        return df
+
     # Step 8: Plot clusters
     plt.figure(figsize=(10, 8))
     cluster_colors = {'Small': 'green', 'Medium': 'orange', 'Large': 'red'}
@@ -64,6 +74,7 @@ def cluster_boulders(df_path=None):
     plt.legend(title="Boulder Size", fontsize=10, loc='upper right')
 
     # Step 9: Save the plot
-    plt.savefig(plot_file, dpi=300)
+    plt.savefig(plot_file, dpi=dpi)
     plt.close()
     print(f"[✅] Clustered plot saved to: {plot_file}")
+    return df
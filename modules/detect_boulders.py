@@ -3,87 +3,210 @@ import pandas as pd
 import numpy as np
 import os
 
-def detect_boulders(image_path):
+from modules.memory_budget import read_scaled
+from modules.tiling import iter_tiles, local_rect
+
+TILE_SIZE = 1024
+TILE_MARGIN = 96  # Covers the largest boulder (r=40) plus the blur kernel
+
+BOULDER_COLUMNS = [
+    'X', 'Y', 'Diameter (m)', 'Area', 'Perimeter',
+    'Circularity', 'AspectRatio', 'ShapeType'
+]
+
+# Unfiltered per-contour features, persisted so thresholds can be re-tuned later
+CANDIDATE_COLUMNS = [
+    'X', 'Y', 'Radius', 'Area', 'Perimeter',
+    'Circularity', 'AspectRatio', 'Brightness'
+]
+
+DEFAULT_THRESHOLDS = {
+    'min_area': 10,
+    'min_radius': 2,
+    'max_radius': 40,               # Upper limit to skip big craters
+    'min_brightness': 80,           # Darker blobs are likely craters
+    'round_min_circularity': 0.85,
+    'round_min_aspect': 0.9,
+    'round_max_aspect': 1.1,
+    'elongated_min_aspect': 1.5,
+    'elongated_max_aspect': 0.7
+}
+
+SHAPE_COLORS = {
+    'Round': (0, 255, 0),
+    'Elongated': (0, 165, 255),
+    'Irregular': (0, 0, 255)
+}
+
+
+def extract_candidates(gray, blurred, threshold_value, offset=(0, 0), core=None, brightness_range=None):
     """
-    Detects boulders in an image, calculates their features, and saves the results.
-    Filters out likely craters based on size and brightness.
+    Runs contour detection on a grayscale region using a fixed threshold and
+    measures every contour, without any size, brightness or shape filtering.
+    `offset` is the region's top-left corner in the full frame, and `core`
+    (x0, y0, x1, y1 in region coordinates) keeps only contours centred inside it.
+    For 16-bit regions, `brightness_range` (lo, hi) maps brightness onto the
+    0-255 scale the thresholds are expressed in.
+    Returns a DataFrame in CANDIDATE_COLUMNS order, in full-frame coordinates.
     """
-    # Step 1: Load the image
-    img = cv2.imread(image_path)
-
-    # Step 2: Ensure the image is in 3-channel format
-    if img is None:
-        raise ValueError("Image not found or unable to read.")
-    if len(img.shape) < 3 or img.shape[2] == 1:
-        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
-
-    # Step 3: Preprocessing (Grayscale and Blurring)
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    blurred = cv2.GaussianBlur(gray, (11, 11), 0)
-
-    # Step 4: Thresholding (Otsu's Method)
-    _, thresh = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-
-    # Step 5: Contour Detection
+    if blurred.dtype == np.uint8:
+        _, thresh = cv2.threshold(blurred, threshold_value, 255, cv2.THRESH_BINARY)
+    else:
+        thresh = (blurred > threshold_value).astype(np.uint8) * 255
     contours, _ = cv2.findContours(thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
 
-    # Step 6: Initialize Data Storage
-    boulder_data = []
-
+    candidates = []
     for contour in contours:
-        area = cv2.contourArea(contour)
-        if area < 10:
-            continue
-
         (x, y), radius = cv2.minEnclosingCircle(contour)
-        if radius < 2 or radius > 40:  # Upper limit to skip big craters
+        if core is not None and not (core[0] <= x < core[2] and core[1] <= y < core[3]):
             continue
 
-        # Create mask to measure brightness inside contour
-        mask = np.zeros(gray.shape, dtype=np.uint8)
-        cv2.drawContours(mask, [contour], -1, 255, -1)
-        mean_brightness = cv2.mean(gray, mask=mask)[0]
-
-        if mean_brightness < 80:  # Dark blob? Likely a crater
-            continue
-
-        # Additional features
-        diameter = 2 * radius
+        area = cv2.contourArea(contour)
         perimeter = cv2.arcLength(contour, True)
         circularity = (4 * np.pi * area) / (perimeter ** 2) if perimeter != 0 else 0
 
         x_min, y_min, width, height = cv2.boundingRect(contour)
         aspect_ratio = width / height if height != 0 else 1.0
 
-        # Shape Classification
-        if circularity > 0.85 and 0.9 < aspect_ratio < 1.1:
-            shape = 'Round'
-        elif aspect_ratio > 1.5 or aspect_ratio < 0.7:
-            shape = 'Elongated'
-        else:
-            shape = 'Irregular'
-
-        # Color for visualization
-        color = (0, 255, 0) if shape == 'Round' else (0, 165, 255) if shape == 'Elongated' else (0, 0, 255)
-        cv2.circle(img, (int(x), int(y)), int(radius), color, 2)
-
-        boulder_data.append([
-            int(x), int(y), round(diameter, 2),
-            round(area, 2), round(perimeter, 2),
-            round(circularity, 2), round(aspect_ratio, 2), shape
+        # Measure brightness inside the contour, masking only its bounding box
+        mask = np.zeros((height, width), dtype=np.uint8)
+        cv2.drawContours(mask, [contour], -1, 255, -1, offset=(-x_min, -y_min))
+        window = gray[y_min:y_min + height, x_min:x_min + width]
+        mean_brightness = cv2.mean(window, mask=mask)[0]
+        if brightness_range is not None:
+            lo, hi = brightness_range
+            mean_brightness = min(max((mean_brightness - lo) * 255 / (hi - lo), 0), 255)
+
+        candidates.append([
+            x + offset[0], y + offset[1], radius, area, perimeter,
+            circularity, aspect_ratio, mean_brightness
         ])
 
-    # Save output
+    return pd.DataFrame(candidates, columns=CANDIDATE_COLUMNS)
+
+
+def extract_candidates_tiled(gray, blurred, threshold_value, tile_size=TILE_SIZE, margin=TILE_MARGIN):
+    """
+    Same as extract_candidates, but thresholds and traces contours one tile at
+    a time so only a tile-sized binary image and contour list exist at once.
+    """
+    height, width = gray.shape
+    tiles = [pd.DataFrame(columns=CANDIDATE_COLUMNS)]
+    for core, region in iter_tiles(height, width, tile_size, margin):
+        x0, y0, x1, y1 = region
+        tiles.append(extract_candidates(
+            gray[y0:y1, x0:x1], blurred[y0:y1, x0:x1], threshold_value,
+            offset=(x0, y0), core=local_rect(core, region)
+        ))
+    return pd.concat(tiles, ignore_index=True).astype(float)
+
+
+def filter_candidates(candidates, thresholds=None):
+    """
+    Applies size and brightness thresholds to a candidate table and classifies
+    the remaining shapes. Missing thresholds fall back to DEFAULT_THRESHOLDS.
+    Returns a DataFrame in BOULDER_COLUMNS order.
+    """
+    t = dict(DEFAULT_THRESHOLDS, **(thresholds or {}))
+
+    keep = (
+        (candidates['Area'] >= t['min_area']) &
+        (candidates['Radius'] >= t['min_radius']) &
+        (candidates['Radius'] <= t['max_radius']) &
+        (candidates['Brightness'] >= t['min_brightness'])
+    )
+    df = candidates[keep]
+
+    # Shape Classification
+    circularity, aspect = df['Circularity'], df['AspectRatio']
+    shape = np.select(
+        [
+            (circularity > t['round_min_circularity']) &
+            (aspect > t['round_min_aspect']) & (aspect < t['round_max_aspect']),
+            (aspect > t['elongated_min_aspect']) | (aspect < t['elongated_max_aspect'])
+        ],
+        ['Round', 'Elongated'],
+        default='Irregular'
+    )
+
+    return pd.DataFrame({
+        'X': df['X'].astype(int),
+        'Y': df['Y'].astype(int),
+        'Diameter (m)': (2 * df['Radius']).round(2),
+        'Area': df['Area'].round(2),
+        'Perimeter': df['Perimeter'].round(2),
+        'Circularity': circularity.round(2),
+        'AspectRatio': aspect.round(2),
+        'ShapeType': shape
+    }, columns=BOULDER_COLUMNS).reset_index(drop=True)
+
+
+def draw_boulders(img, boulders, scale=1.0):
+    """
+    Draws detected boulders onto a BGR image, coloured by shape type.
+    `scale` maps full-resolution coordinates onto a downscaled image.
+    """
+    for x, y, diameter, shape in boulders[['X', 'Y', 'Diameter (m)', 'ShapeType']].itertuples(index=False):
+        center = (int(x * scale), int(y * scale))
+        cv2.circle(img, center, max(1, int(diameter / 2 * scale)), SHAPE_COLORS[shape], 2)
+    return img
+
+
+def detect_boulders(image_path, tiled=False, render_scale=1.0):
+    """
+    Detects boulders in an image, calculates their features, and saves the results.
+    Filters out likely craters based on size and brightness.
+    With tiled=True only the grayscale frame is held in memory and contours are
+    traced per tile; render_scale < 1 draws the overlay on a downscaled image.
+    """
+    if tiled:
+        # Step 1-3: Load straight to grayscale and blur
+        gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            raise ValueError("Image not found or unable to read.")
+        blurred = cv2.GaussianBlur(gray, (11, 11), 0)
+        img = None
+    else:
+        # Step 1: Load the image
+        img = cv2.imread(image_path)
+
+        # Step 2: Ensure the image is in 3-channel format
+        if img is None:
+            raise ValueError("Image not found or unable to read.")
+        if len(img.shape) < 3 or img.shape[2] == 1:
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+
+        # Step 3: Preprocessing (Grayscale and Blurring)
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        blurred = cv2.GaussianBlur(gray, (11, 11), 0)
+
+    # Step 4: Thresholding (Otsu's Method)
+    otsu_value, _ = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+    # Step 5: Contour Detection and Feature Extraction
+    if tiled:
+        candidates = extract_candidates_tiled(gray, blurred, otsu_value)
+    else:
+        candidates = extract_candidates(gray, blurred, otsu_value)
+    df = filter_candidates(candidates)
+    del gray, blurred
+
+    if render_scale < 1:
+        img = None  # Release the full-resolution copy before decoding a smaller one
+    if img is None:
+        img = read_scaled(image_path, render_scale)
+
+    # Step 6: Save output
     os.makedirs('static', exist_ok=True)
+    candidates_csv = 'static/boulder_candidates.csv'
+    candidates.to_csv(candidates_csv, index=False)
+    print(f"[✅] {len(candidates)} boulder candidates saved to: {candidates_csv}")
+
     detected_image_path = 'static/boulders_detected.jpg'
-    cv2.imwrite(detected_image_path, img)
+    cv2.imwrite(detected_image_path, draw_boulders(img, df, render_scale))
     print(f"[✅] Detected boulders image saved to: {detected_image_path}")
 
     output_csv = 'static/boulder_data.csv'
-    df = pd.DataFrame(boulder_data, columns=[
-        'X', 'Y', 'Diameter (m)', 'Area', 'Perimeter',
-        'Circularity', 'AspectRatio', 'ShapeType'
-    ])
     df.to_csv(output_csv, index=False)
     print(f"[✅] Boulder data saved to: {output_csv}")
 
@@ -1,76 +1,165 @@
 import cv2
 import numpy as np
+import json
 import os
 
-def detect_landslides(image_path):
-    """
-    Detects potential landslide regions in an input image and saves a visualized output.
+from modules.memory_budget import read_scaled
+from modules.tiling import iter_tiles, local_rect
+
+TILE_SIZE = 1024
+TILE_MARGIN = 64
 
-    Args:
-        image_path (str): Path to the input image.
+
+def find_landslides(equalized, offset=(0, 0), core=None):
+    """
+    Finds landslide candidates in a histogram-equalized grayscale region.
+    `offset` is the region's top-left corner in the full frame, and `core`
+    (x0, y0, x1, y1 in region coordinates) keeps only regions whose bounding
+    box starts inside it.
 
     Returns:
-        list: A list of dictionaries containing properties of detected landslide regions.
+        tuple: (candidates, contours) in full-frame coordinates.
     """
-    try:
-        # Check if the image path exists
-        if not os.path.exists(image_path):
-            raise FileNotFoundError(f"Input image not found: {image_path}")
+    # Step 1: Apply Gaussian blur to reduce noise
+    blurred = cv2.GaussianBlur(equalized, (5, 5), 0)
 
-        # Load image
-        img = cv2.imread(image_path)
-        if img is None:
-            raise ValueError(f"Unable to read image from path: {image_path}")
+    # Step 2: Edge detection to highlight slope breaks
+    edges = cv2.Canny(blurred, threshold1=50, threshold2=150)
 
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    # Step 3: Morphological operations to close gaps in edges
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5))
+    closed = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel)
 
-        # Step 1: Histogram equalization for contrast enhancement
-        equalized = cv2.equalizeHist(gray)
+    # Step 4: Find contours in the processed image
+    contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    landslide_candidates = []
+    landslide_contours = []
+
+    for cnt in contours:
+        area = cv2.contourArea(cnt)
+        if area > 500:  # Filter small areas (noise)
+            # Approximate shape and calculate bounding box
+            approx = cv2.approxPolyDP(cnt, 0.02 * cv2.arcLength(cnt, True), True)
+            x, y, w, h = cv2.boundingRect(approx)
+
+            if core is not None and not (core[0] <= x < core[2] and core[1] <= y < core[3]):
+                continue
+
+            # Aspect ratio (optional filtering can be applied here)
+            aspect_ratio = w / h if h != 0 else 0
+
+            # Append candidate properties
+            landslide_candidates.append({
+                'x': int(x) + offset[0],
+                'y': int(y) + offset[1],
+                'width': int(w),
+                'height': int(h),
+                'area': round(area, 2),
+                'aspect_ratio': round(aspect_ratio, 2)
+            })
+            landslide_contours.append(cnt + np.array(offset, dtype=cnt.dtype))
 
-        # Step 2: Apply Gaussian blur to reduce noise
-        blurred = cv2.GaussianBlur(equalized, (5, 5), 0)
+    return landslide_candidates, landslide_contours
 
-        # Step 3: Edge detection to highlight slope breaks
-        edges = cv2.Canny(blurred, threshold1=50, threshold2=150)
 
-        # Step 4: Morphological operations to close gaps in edges
-        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5))
-        closed = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel)
+def save_landslide_data(candidates, contours, output_json='static/landslide_data.json'):
+    """
+    Saves landslide candidates together with their contour points so the
+    overlay can be redrawn without re-running detection.
+    """
+    records = [
+        dict(candidate, contour=cnt.reshape(-1, 2).tolist())
+        for candidate, cnt in zip(candidates, contours)
+    ]
+    os.makedirs(os.path.dirname(output_json), exist_ok=True)
+    with open(output_json, 'w', encoding='utf-8') as f:
+        json.dump(records, f)
+    return output_json
+
 
-        # Step 5: Find contours in the processed image
-        contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+def load_landslide_data(input_json='static/landslide_data.json'):
+    """
+    Loads landslide candidates and contours written by save_landslide_data.
+    """
+    with open(input_json, 'r', encoding='utf-8') as f:
+        records = json.load(f)
 
-        landslide_candidates = []
-        landslide_img = img.copy()
+    candidates, contours = [], []
+    for record in records:
+        points = record.pop('contour')
+        candidates.append(record)
+        contours.append(np.array(points, dtype=np.int32).reshape(-1, 1, 2))
+    return candidates, contours
 
-        for cnt in contours:
-            area = cv2.contourArea(cnt)
-            if area > 500:  # Filter small areas (noise)
-                # Approximate shape and calculate bounding box
-                approx = cv2.approxPolyDP(cnt, 0.02 * cv2.arcLength(cnt, True), True)
-                x, y, w, h = cv2.boundingRect(approx)
 
-                # Aspect ratio (optional filtering can be applied here)
-                aspect_ratio = w / h if h != 0 else 0
+def detect_landslides(image_path, tiled=False, render_scale=1.0, raise_errors=False):
+    """
+    Detects potential landslide regions in an input image and saves a visualized output.
 
-                # Draw contour on the visualization image
-                cv2.drawContours(landslide_img, [cnt], -1, (255, 0, 0), 2)
+    Args:
+        image_path (str): Path to the input image.
+        tiled (bool): Load only the grayscale frame and trace edges tile by tile.
+            Regions larger than a tile margin may be split at tile borders.
+        render_scale (float): Draw the overlay on a downscaled copy (1, 1/2, 1/4 or 1/8).
+        raise_errors (bool): Re-raise failures instead of returning an empty list.
 
-                # Append candidate properties
-                landslide_candidates.append({
-                    'x': int(x),
-                    'y': int(y),
-                    'width': int(w),
-                    'height': int(h),
-                    'area': round(area, 2),
-                    'aspect_ratio': round(aspect_ratio, 2)
-                })
+    Returns:
+        list: A list of dictionaries containing properties of detected landslide regions.
+    """
+    try:
+        # Check if the image path exists
+        if not os.path.exists(image_path):
+            raise FileNotFoundError(f"Input image not found: {image_path}")
+
+        # Load image
+        if tiled:
+            img = None
+            gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+            if gray is None:
+                raise ValueError(f"Unable to read image from path: {image_path}")
+        else:
+            img = cv2.imread(image_path)
+            if img is None:
+                raise ValueError(f"Unable to read image from path: {image_path}")
+
+            # Convert to grayscale
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+        # Histogram equalization for contrast enhancement
+        equalized = cv2.equalizeHist(gray)
+        del gray
+
+        if tiled:
+            landslide_candidates, landslide_contours = [], []
+            height, width = equalized.shape
+            for core, region in iter_tiles(height, width, TILE_SIZE, TILE_MARGIN):
+                x0, y0, x1, y1 = region
+                tile_candidates, tile_contours = find_landslides(
+                    equalized[y0:y1, x0:x1], offset=(x0, y0), core=local_rect(core, region)
+                )
+                landslide_candidates += tile_candidates
+                landslide_contours += tile_contours
+        else:
+            landslide_candidates, landslide_contours = find_landslides(equalized)
+        del equalized
+
+        # Draw contours on the visualization image
+        if render_scale < 1 or img is None:
+            img = None  # Release the full-resolution copy before decoding a smaller one
+            landslide_img = read_scaled(image_path, render_scale)
+            drawn_contours = [(cnt * render_scale).astype(np.int32) for cnt in landslide_contours]
+        else:
+            landslide_img = img
+            drawn_contours = landslide_contours
+        if drawn_contours:
+            cv2.drawContours(landslide_img, drawn_contours, -1, (255, 0, 0), 2)
 
         # Save visualization
         os.makedirs('static', exist_ok=True)
         output_path = 'static/landslides_detected.jpg'
         cv2.imwrite(output_path, landslide_img)
+        save_landslide_data(landslide_candidates, landslide_contours)
 
         print(f" Landslides detected and saved to {output_path}")
         print(f"Total landslide candidates detected: {len(landslide_candidates)}")
@@ -80,4 +169,6 @@ def detect_landslides(image_path):
     except Exception as e:
         # Ensure error messages handle any character encoding issues
         print(f"[ERROR] Failed to detect landslides: {str(e).encode('utf-8', 'replace').decode('utf-8')}")
+        if raise_errors:
+            raise
         return []
@@ -6,8 +6,13 @@ from sklearn.linear_model import LinearRegression
 def estimate_source(
     csv_path='static/boulder_data_clustered.csv',
     image_path='static/boulders_detected.jpg',
-    output_path='static/boulders_with_source.jpg'
+    output_path='static/boulders_with_source.jpg',
+    render_scale=1.0
 ):
+    """
+    Fits the boulder trail and marks its projected source on the detection image.
+    `render_scale` is the scale the detection image was rendered at.
+    """
     # Load boulder data
     df = pd.read_csv(csv_path)
     df.columns = df.columns.str.strip()
@@ -31,9 +36,10 @@ def estimate_source(
     img = cv2.imread(image_path)
     if img is not None:
         # Draw a single red dot at the source
-        cv2.circle(img, (estimated_source_x, estimated_source_y), 30, (255, 0, 0), -1)  # 🔵 blue
+        draw_x, draw_y = int(estimated_source_x * render_scale), int(estimated_source_y * render_scale)
+        cv2.circle(img, (draw_x, draw_y), max(1, int(30 * render_scale)), (255, 0, 0), -1)  # 🔵 blue
 
-        cv2.putText(img, 'Estimated Source', (estimated_source_x + 15, estimated_source_y - 10),
+        cv2.putText(img, 'Estimated Source', (draw_x + 15, draw_y - 10),
             cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 0, 0), 2)  # 🔵 blue label
 
         cv2.imwrite(output_path, img)
@@ -5,9 +5,11 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import os
 
-def generate_heatmap(csv_path='static/boulder_data_clustered.csv', output_path='static/risk_heatmap.jpg'):
+def generate_heatmap(csv_path='static/boulder_data_clustered.csv', output_path='static/risk_heatmap.jpg', dpi=300,
+                     raise_errors=False):
     """
     Generates a KDE heatmap from boulder data CSV.
+    Pass raise_errors=True to re-raise failures instead of only logging them.
     """
     # Step 1: Check if the input file exists
     if not os.path.exists(csv_path):
@@ -47,7 +49,7 @@ def generate_heatmap(csv_path='static/boulder_data_clustered.csv', output_path='
         # Step 8: Save the heatmap to file
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
         plt.tight_layout()
-        plt.savefig(output_path, dpi=300)
+        plt.savefig(output_path, dpi=dpi)
         plt.close()
 
         # Step 9: Success logging
@@ -58,3 +60,6 @@ def generate_heatmap(csv_path='static/boulder_data_clustered.csv', output_path='
     except Exception as e:
         # Step 10: Exception handling
         print(f"[ERROR] Failed to generate heatmap: {e}")
+        plt.close()
+        if raise_errors:
+            raise
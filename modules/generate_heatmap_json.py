@@ -2,13 +2,17 @@ import pandas as pd
 import json
 import os
 
-def generate_heatmap_json(input_csv='static/boulder_data_clustered.csv', output_json='static/boulder_points.json'):
+def generate_heatmap_json(input_csv='static/boulder_data_clustered.csv', output_json='static/boulder_points.json',
+                          raise_errors=False):
     """
     Converts clustered boulder CSV into a Leaflet-compatible heatmap JSON.
     Normalizes X and Y coordinates to a 0–1 scale and assigns fixed intensity.
+    Pass raise_errors=True to re-raise failures instead of returning False.
     """
     if not os.path.exists(input_csv):
         print(f"[ERROR] Input CSV not found: {input_csv}")
+        if raise_errors:
+            raise FileNotFoundError(f"Input CSV not found: {input_csv}")
         return False
 
     try:
@@ -24,12 +28,8 @@ def generate_heatmap_json(input_csv='static/boulder_data_clustered.csv', output_
         # Drop rows with missing values in X or Y
         df = df.dropna(subset=['X', 'Y'])
 
-        # Ensure there is data to process
-        if df.empty:
-            raise ValueError("No valid data available after dropping NaNs in 'X' and 'Y'.")
-
-        # Normalize coordinates to 0–1 scale
-        max_x, max_y = df['X'].max(), df['Y'].max()
+        # Normalize coordinates to 0–1 scale; no boulders gives an empty point list
+        max_x, max_y = (df['X'].max(), df['Y'].max()) if not df.empty else (1, 1)
         if max_x == 0 or max_y == 0:
             raise ValueError("Cannot normalize with zero max value for 'X' or 'Y'.")
 
@@ -51,4 +51,6 @@ def generate_heatmap_json(input_csv='static/boulder_data_clustered.csv', output_
         # Handle encoding issues in exception messages
         safe_error = str(e).encode('utf-8', errors='replace').decode('utf-8')
         print(f"[ERROR] Failed to generate heatmap JSON: {safe_error}")
+        if raise_errors:
+            raise
         return False
@@ -1,10 +1,33 @@
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
 from datetime import datetime
+import cv2
 import os
-
-def generate_pdf(timestamp=None, output_path=None):
+import tempfile
+
+from modules.memory_budget import REPORT_MAX_SIDE, read_bounded
+
+def report_image(path, folder):
+    """
+    Writes a copy of an image bounded to REPORT_MAX_SIDE into `folder`, decoded
+    at reduced size so full-resolution overlays are never held in memory.
+    reportlab embeds a JPEG file as is, without decoding it again.
+
+    Returns:
+        tuple: Path of the copy, its width and its height.
+    """
+    img = read_bounded(path, REPORT_MAX_SIDE)
+    bounded_path = os.path.join(folder, os.path.basename(path))
+    if not cv2.imwrite(bounded_path, img, [cv2.IMWRITE_JPEG_QUALITY, 90]):
+        raise ValueError(f"Unable to write report image: {bounded_path}")
+    return bounded_path, img.shape[1], img.shape[0]
+
+def generate_pdf(timestamp=None, output_path=None, raise_errors=False):
+    """
+    Renders the analysis report from the stats summary and result images.
+    On failure an error page is written in its place; pass raise_errors=True
+    to re-raise the failure afterwards instead of returning None.
+    """
     try:
         if timestamp is None:
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -19,6 +42,7 @@ def generate_pdf(timestamp=None, output_path=None):
         c = canvas.Canvas(output_path, pagesize=letter)
         width, height = letter
         margin = 50
+        scratch = tempfile.TemporaryDirectory()
 
         # Header
         c.setFont("Helvetica-Bold", 16)
@@ -69,8 +93,7 @@ def generate_pdf(timestamp=None, output_path=None):
             scaled_height = 0
             if os.path.exists(path):
                 try:
-                    img = ImageReader(path)
-                    img_width, img_height = img.getSize()
+                    img, img_width, img_height = report_image(path, scratch.name)
                     max_width = width - 2 * margin
                     max_height = 250
                     aspect_ratio = img_width / img_height
@@ -102,7 +125,7 @@ def generate_pdf(timestamp=None, output_path=None):
                 try:
                     x_pos = (width - scaled_width) / 2
                     y_pos = y_offset - scaled_height
-                    c.drawImage(path, x_pos, y_pos, scaled_width, scaled_height)
+                    c.drawImage(img, x_pos, y_pos, scaled_width, scaled_height)
                     y_offset = y_pos - 30
                     print(f"[📷] Added image to PDF: {title}")
 
@@ -160,6 +183,7 @@ def generate_pdf(timestamp=None, output_path=None):
 
         add_footer(1)
         c.save()
+        scratch.cleanup()
         print(f"[✅] Fresh PDF report saved to: {output_path}")
         return output_path
 
@@ -176,4 +200,6 @@ def generate_pdf(timestamp=None, output_path=None):
             print(f"[📄] Error PDF created: {output_path}")
         except:
             pass
+        if raise_errors:
+            raise
         return None
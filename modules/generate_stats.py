@@ -1,4 +1,8 @@
-def generate_stats():
+def generate_stats(raise_errors=False):
+    """
+    Writes a readable statistics summary of the detected boulders.
+    Pass raise_errors=True to re-raise failures after writing the error summary.
+    """
     import pandas as pd
     import numpy as np
     import os
@@ -45,10 +49,24 @@ def generate_stats():
                     break
             
             if diameter_col is None:
-                print("[❌] No diameter/size column found in boulder data")
-                return
+                raise ValueError("No diameter/size column found in boulder data")
         else:
             diameter_col = "Diameter (m)"
+
+        # Strict thresholds can leave no boulders at all
+        if total == 0:
+            output_path = "static/stats_summary.txt"
+            with open(output_path, "w", encoding='utf-8') as f:
+                f.write("🌕 Boulder Detection Statistics Summary\n")
+                f.write("=" * 50 + "\n\n")
+                f.write(f"📅 Analysis Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+                f.write("📊 DETECTION SUMMARY\n")
+                f.write("-" * 25 + "\n")
+                f.write("🪨 Total Boulders Detected : 0\n\n")
+                f.write("No boulders passed the detection thresholds.\n\n")
+                f.write("🏷️ Generated by SOMA - Advanced Lunar Analysis System\n")
+            print(f"[✅] Empty statistics saved to {output_path}")
+            return
         
         min_d = df[diameter_col].min()
         max_d = df[diameter_col].max()
@@ -120,4 +138,6 @@ def generate_stats():
             f.write("Boulder Detection Statistics Summary\n")
             f.write("======================================\n\n")
             f.write(f"❌ Error generating statistics: {str(e)}\n")
-            f.write("Please check the boulder detection output files.\n")
\ No newline at end of file
+            f.write("Please check the boulder detection output files.\n")
+        if raise_errors:
+            raise
\ No newline at end of file
@@ -0,0 +1,297 @@
+import cv2
+import numpy as np
+import pandas as pd
+import json
+import os
+from sklearn.neighbors import KDTree
+
+from modules.detect_boulders import (
+    CANDIDATE_COLUMNS, DEFAULT_THRESHOLDS, TILE_MARGIN, extract_candidates, filter_candidates, draw_boulders
+)
+from modules.detect_landslides import find_landslides, save_landslide_data, load_landslide_data
+from modules.job_store import job_path, load_meta
+from modules.memory_budget import read_scaled
+from modules.tiling import iter_tiles, tile_index, local_rect
+
+TILE_SIZE = 256
+DIFF_THRESHOLD = 20     # Grey-level difference (after blurring out codec noise) that marks a pixel as changed
+CHANGE_MIN_AREA = DEFAULT_THRESHOLDS['min_area']  # Smallest changed blob (px) that can be a boulder
+MATCH_RADIUS = 3        # Boulders closer than this (px) are the same, unmoved boulder
+MOVE_RADIUS = 40        # Boulders closer than this (px) are the same boulder, moved
+REFINE_SIZE = 1024      # Side of the full-resolution crop the coarse shift is refined on
+MIN_RESPONSE = 0.1      # Weaker phase-correlation peaks mean the images do not overlap (e.g. another site)
+
+
+def _phase_shift(reference, image):
+    window = cv2.createHanningWindow((image.shape[1], image.shape[0]), cv2.CV_32F)
+    (dx, dy), response = cv2.phaseCorrelate(np.float32(reference), np.float32(image), window)
+    return dx, dy, response
+
+
+def register_images(reference_gray, gray, max_side=1024, refine_size=REFINE_SIZE):
+    """
+    Estimates the sub-pixel (dx, dy) translation of the new image relative to
+    the reference. Phase correlation on downscaled copies finds the coarse
+    shift, which is then refined on a full-resolution crop from the centre,
+    so the error is not magnified by the downscale factor.
+    """
+    scale = min(1.0, max_side / max(gray.shape))
+    ref_small, new_small = reference_gray, gray
+    if scale < 1.0:
+        size = (int(gray.shape[1] * scale), int(gray.shape[0] * scale))
+        ref_small = cv2.resize(reference_gray, size, interpolation=cv2.INTER_AREA)
+        new_small = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+
+    dx, dy, response = _phase_shift(ref_small, new_small)
+    if scale == 1.0:
+        return dx, dy, float(response)
+    dx, dy = int(round(dx / scale)), int(round(dy / scale))
+
+    # Crop the new image where it overlaps the reference moved by the coarse shift
+    height, width = gray.shape
+    crop_w = min(refine_size, width - abs(dx))
+    crop_h = min(refine_size, height - abs(dy))
+    if crop_w < 32 or crop_h < 32:
+        return dx, dy, float(response)
+    x0 = min(max((width - crop_w) // 2, dx), width - crop_w + min(dx, 0))
+    y0 = min(max((height - crop_h) // 2, dy), height - crop_h + min(dy, 0))
+    crop = gray[y0:y0 + crop_h, x0:x0 + crop_w]
+    reference_crop = reference_gray[y0 - dy:y0 - dy + crop_h, x0 - dx:x0 - dx + crop_w]
+
+    rdx, rdy, response = _phase_shift(reference_crop, crop)
+    return dx + rdx, dy + rdy, float(response)
+
+
+def find_changed_tiles(reference_gray, gray, dx, dy):
+    """
+    Aligns the reference onto the new image and returns the set of (column, row)
+    tiles whose content differs, plus the total number of tiles.
+    A tile changes when any boulder-sized blob of changed pixels touches it,
+    so a single new boulder is enough. Blobs are labelled per tile with a
+    margin wider than a boulder, so only one extra frame-sized buffer is held.
+    Tiles not fully covered by the shifted reference always count as changed;
+    the sub-pixel fringe of a fractional shift is filled from the border.
+    """
+    height, width = gray.shape
+    shift = np.float32([[1, 0, dx], [0, 1, dy]])
+    mask = cv2.warpAffine(reference_gray, shift, (width, height), borderMode=cv2.BORDER_REPLICATE)
+    ix, iy = int(round(dx)), int(round(dy))
+    cv2.absdiff(gray, mask, dst=mask)
+    cv2.GaussianBlur(mask, (5, 5), 0, dst=mask)
+    cv2.threshold(mask, DIFF_THRESHOLD, 255, cv2.THRESH_BINARY, dst=mask)
+
+    changed, total = set(), 0
+    for core, region in iter_tiles(height, width, TILE_SIZE, TILE_MARGIN):
+        total += 1
+        x0, y0, x1, y1 = core
+        if not (x0 >= ix and y0 >= iy and x1 <= width + ix and y1 <= height + iy):
+            changed.add(tile_index(x0, y0, TILE_SIZE))
+            continue
+
+        # Any blob at least the size of a boulder that overlaps the core
+        rx0, ry0, rx1, ry1 = region
+        cx0, cy0, cx1, cy1 = local_rect(core, region)
+        count, _, blobs, _ = cv2.connectedComponentsWithStats(mask[ry0:ry1, rx0:rx1], connectivity=8)
+        for x, y, w, h, area in blobs[1:count]:
+            if area >= CHANGE_MIN_AREA and x < cx1 and x + w > cx0 and y < cy1 and y + h > cy0:
+                changed.add(tile_index(x0, y0, TILE_SIZE))
+                break
+    return changed, total
+
+
+def build_change_report(old_boulders, new_boulders):
+    """
+    Matches boulders from the changed tiles of the previous and current runs
+    and lists the ones that are new, moved or vanished.
+    """
+    report = {'new': [], 'moved': [], 'vanished': []}
+    old_xy = old_boulders[['X', 'Y']].to_numpy(dtype=float)
+    new_xy = new_boulders[['X', 'Y']].to_numpy(dtype=float)
+    old_d = old_boulders['Diameter (m)'].tolist()
+    new_d = new_boulders['Diameter (m)'].tolist()
+
+    # Greedy one-to-one matching, closest pairs first
+    pairs = []
+    if len(old_xy) and len(new_xy):
+        indices, distances = KDTree(old_xy).query_radius(
+            new_xy, r=MOVE_RADIUS, return_distance=True, sort_results=True
+        )
+        for new_i, (old_ids, dists) in enumerate(zip(indices, distances)):
+            pairs.extend((d, new_i, old_i) for old_i, d in zip(old_ids, dists))
+    pairs.sort()
+
+    matched_old, matched_new = set(), set()
+    for distance, new_i, old_i in pairs:
+        if new_i in matched_new or old_i in matched_old:
+            continue
+        matched_new.add(new_i)
+        matched_old.add(old_i)
+        if distance > MATCH_RADIUS:
+            report['moved'].append({
+                'from': [int(old_xy[old_i][0]), int(old_xy[old_i][1])],
+                'to': [int(new_xy[new_i][0]), int(new_xy[new_i][1])],
+                'distance': round(float(distance), 2),
+                'diameter': new_d[new_i]
+            })
+
+    for i, (x, y) in enumerate(new_xy):
+        if i not in matched_new:
+            report['new'].append({'x': int(x), 'y': int(y), 'diameter': new_d[i]})
+    for i, (x, y) in enumerate(old_xy):
+        if i not in matched_old:
+            report['vanished'].append({'x': int(x), 'y': int(y), 'diameter': old_d[i]})
+
+    return report
+
+
+def detect_incremental(image_path, reference_job, output_folder='static'):
+    """
+    Re-analyses a repeat observation of a site covered by `reference_job`.
+    Only tiles that changed since the reference are re-detected; cached boulder
+    candidates and landslide results are reused everywhere else. Writes the same
+    artifacts as detect_boulders and detect_landslides, plus a change report.
+
+    Returns:
+        dict: The change report, or None if the images cannot be registered
+        (e.g. a different site of the same size).
+    """
+    # Step 1: Load the new image and the reference; the colour frame is only
+    # needed again for the overlays, so it is decoded a second time then
+    img = cv2.imread(image_path)
+    if img is None:
+        raise ValueError("Image not found or unable to read.")
+    if len(img.shape) < 3 or img.shape[2] == 1:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    del img
+
+    meta = load_meta(reference_job)
+    if not os.path.exists(job_path(reference_job, 'boulder_candidates.csv')):
+        print(f"[⚠️] Job {reference_job} has no cached candidates, running full analysis")
+        return None
+    # Jobs saved before source_is_preview existed only stored source_scale for previews
+    if meta.get('source_is_preview', 'source_scale' in meta):
+        print(f"[⚠️] Job {reference_job} only kept a preview of its source, running full analysis")
+        return None
+    reference_gray = cv2.imread(job_path(reference_job, meta['source']), cv2.IMREAD_GRAYSCALE)
+    if reference_gray is None or reference_gray.shape != gray.shape:
+        print(f"[⚠️] Image size differs from job {reference_job}, running full analysis")
+        return None
+
+    # Step 2: Register and find changed tiles
+    dx, dy, response = register_images(reference_gray, gray)
+    print(f"[🧭] Registered against job {reference_job}: shift=({dx:.2f}, {dy:.2f}), response={response:.3f}")
+    if response < MIN_RESPONSE:
+        print(f"[⚠️] Registration against job {reference_job} is unreliable, running full analysis")
+        return None
+    changed, total_tiles = find_changed_tiles(reference_gray, gray, dx, dy)
+    del reference_gray
+    print(f"[🧩] {len(changed)}/{total_tiles} tiles changed")
+
+    height, width = gray.shape
+
+    def in_changed_tile(xs, ys):
+        outside = (xs < 0) | (xs >= width) | (ys < 0) | (ys >= height)
+        tiles = zip((xs // TILE_SIZE).astype(int), (ys // TILE_SIZE).astype(int))
+        return outside | np.array([tile in changed for tile in tiles], dtype=bool)
+
+    # Step 3: Load cached results, shifted into the new frame
+    candidates = pd.read_csv(job_path(reference_job, 'boulder_candidates.csv'))
+    candidates['X'] += dx
+    candidates['Y'] += dy
+    candidates = candidates[~in_changed_tile(candidates['X'], candidates['Y'])]
+
+    previous = pd.read_csv(job_path(reference_job, 'boulder_data.csv'))
+    previous['X'] += dx
+    previous['Y'] += dy
+    previous = previous[in_changed_tile(previous['X'], previous['Y'])]
+
+    # Landslide boxes and contours are whole pixels. A cached landslide is only
+    # reused if its whole box lies in unchanged tiles; otherwise it is re-detected
+    # from the tile it starts in, and so are the others starting there
+    cached_landslides = []
+    landslide_tiles = set(changed)
+    landslide_cache = job_path(reference_job, 'landslide_data.json')
+    if os.path.exists(landslide_cache):
+        shift = (int(round(dx)), int(round(dy)))
+        for candidate, cnt in zip(*load_landslide_data(landslide_cache)):
+            candidate['x'] += shift[0]
+            candidate['y'] += shift[1]
+            cached_landslides.append((candidate, cnt + np.array(shift, dtype=cnt.dtype)))
+            x, y, w, h = candidate['x'], candidate['y'], candidate['width'], candidate['height']
+            xs, ys = np.meshgrid(np.arange(x, x + w, TILE_SIZE).tolist() + [x + w - 1],
+                                 np.arange(y, y + h, TILE_SIZE).tolist() + [y + h - 1])
+            if in_changed_tile(xs.ravel(), ys.ravel()).any() and 0 <= x < width and 0 <= y < height:
+                landslide_tiles.add(tile_index(x, y, TILE_SIZE))
+
+    landslides, contours = [], []
+    for candidate, cnt in cached_landslides:
+        x, y = candidate['x'], candidate['y']
+        if 0 <= x < width and 0 <= y < height and tile_index(x, y, TILE_SIZE) not in landslide_tiles:
+            landslides.append(candidate)
+            contours.append(cnt)
+
+    # Step 4: Re-detect changed tiles only
+    redetected = [pd.DataFrame(columns=CANDIDATE_COLUMNS)]
+    if landslide_tiles:
+        if changed:
+            blurred = cv2.GaussianBlur(gray, (11, 11), 0)
+            otsu_value, _ = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        equalized = cv2.equalizeHist(gray)
+
+        for core, region in iter_tiles(height, width, TILE_SIZE, TILE_MARGIN):
+            tile = tile_index(core[0], core[1], TILE_SIZE)
+            if tile not in landslide_tiles:
+                continue
+            x0, y0, x1, y1 = region
+            local_core = local_rect(core, region)
+            if tile in changed:
+                redetected.append(extract_candidates(
+                    gray[y0:y1, x0:x1], blurred[y0:y1, x0:x1], otsu_value,
+                    offset=(x0, y0), core=local_core
+                ))
+            tile_landslides, tile_contours = find_landslides(
+                equalized[y0:y1, x0:x1], offset=(x0, y0), core=local_core
+            )
+            landslides += tile_landslides
+            contours += tile_contours
+        if changed:
+            del blurred
+        del equalized
+    del gray
+    redetected = pd.concat(redetected, ignore_index=True).astype(float)
+
+    # Step 5: Save the merged results
+    os.makedirs(output_folder, exist_ok=True)
+    candidates = pd.concat([candidates, redetected], ignore_index=True)
+    candidates.to_csv(os.path.join(output_folder, 'boulder_candidates.csv'), index=False)
+
+    df = filter_candidates(candidates)
+    new_boulders = filter_candidates(redetected)
+    df.to_csv(os.path.join(output_folder, 'boulder_data.csv'), index=False)
+    img = read_scaled(image_path)
+    cv2.imwrite(os.path.join(output_folder, 'boulders_detected.jpg'), draw_boulders(img, df))
+    del img
+
+    img = read_scaled(image_path)
+    if contours:
+        cv2.drawContours(img, contours, -1, (255, 0, 0), 2)
+    cv2.imwrite(os.path.join(output_folder, 'landslides_detected.jpg'), img)
+    save_landslide_data(landslides, contours, os.path.join(output_folder, 'landslide_data.json'))
+
+    # Step 6: Change report
+    report = build_change_report(previous, new_boulders)
+    report.update({
+        'reference_job': reference_job,
+        'registration': {'dx': round(dx, 2), 'dy': round(dy, 2), 'response': round(response, 4)},
+        'tiles_total': total_tiles,
+        'tiles_changed': len(changed),
+        'boulders_reused': len(df) - len(new_boulders),
+        'boulders_redetected': len(new_boulders)
+    })
+    with open(os.path.join(output_folder, 'change_report.json'), 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"[✅] Incremental analysis: {len(report['new'])} new, "
+          f"{len(report['moved'])} moved, {len(report['vanished'])} vanished boulders")
+    return report
@@ -0,0 +1,133 @@
+import os
+import re
+import json
+import uuid
+import shutil
+from datetime import datetime
+from PIL import Image
+
+JOBS_FOLDER = 'jobs'
+MAX_JOBS = int(os.environ.get('SOMA_MAX_JOBS', 20))
+
+_JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+# Per-job artifacts copied out of the static folder so later runs can reuse them
+CACHED_ARTIFACTS = [
+    'boulder_data.csv',
+    'boulder_candidates.csv',
+    'landslide_data.json'
+]
+
+# Names the job whose results currently fill the static folder
+CURRENT_JOB_FILE = 'current_job.txt'
+
+
+def new_job_id():
+    return uuid.uuid4().hex
+
+
+def job_path(job_id, filename=''):
+    """
+    Returns the path of a file inside a job's folder.
+    Rejects anything that is not a generated job id.
+    """
+    if not isinstance(job_id, str) or not _JOB_ID_PATTERN.match(job_id):
+        raise ValueError(f"Invalid job id: {job_id}")
+    return os.path.join(JOBS_FOLDER, job_id, filename)
+
+
+def job_exists(job_id):
+    try:
+        return os.path.exists(job_path(job_id, 'meta.json'))
+    except ValueError:
+        return False
+
+
+def load_meta(job_id):
+    with open(job_path(job_id, 'meta.json'), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_job(job_id, image_path, static_folder='static', extra=None):
+    """
+    Stores the source image and detection artifacts of a finished analysis
+    so that later uploads of the same site can be compared against it.
+    `extra` is merged into the job's metadata (e.g. memory usage).
+    """
+    os.makedirs(job_path(job_id), exist_ok=True)
+
+    source_name = 'source' + os.path.splitext(image_path)[1].lower()
+    shutil.copy(image_path, job_path(job_id, source_name))
+
+    for filename in CACHED_ARTIFACTS:
+        artifact = os.path.join(static_folder, filename)
+        if os.path.exists(artifact):
+            shutil.copy(artifact, job_path(job_id, filename))
+
+    with Image.open(image_path) as img:
+        width, height = img.size
+
+    meta = {
+        'job_id': job_id,
+        'created': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'source': source_name,
+        'width': width,
+        'height': height,
+        **(extra or {})
+    }
+    with open(job_path(job_id, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+
+    print(f"[💾] Saved job {job_id}")
+    prune_jobs()
+    return meta
+
+
+def prune_jobs(keep=MAX_JOBS):
+    """
+    Removes the oldest job folders beyond the retention limit.
+    """
+    if not os.path.isdir(JOBS_FOLDER):
+        return
+
+    folders = [
+        os.path.join(JOBS_FOLDER, name) for name in os.listdir(JOBS_FOLDER)
+        if _JOB_ID_PATTERN.match(name)
+    ]
+    folders.sort(key=os.path.getmtime, reverse=True)
+    for folder in folders[keep:]:
+        shutil.rmtree(folder, ignore_errors=True)
+        print(f"[🗑️] Removed old job: {os.path.basename(folder)}")
+
+
+def set_current_job(job_id, static_folder='static'):
+    with open(os.path.join(static_folder, CURRENT_JOB_FILE), 'w', encoding='utf-8') as f:
+        f.write(job_id)
+
+
+def current_job(static_folder='static'):
+    try:
+        with open(os.path.join(static_folder, CURRENT_JOB_FILE), 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def write_status(job_id, status):
+    """
+    Records a job's progress (e.g. quick-look results awaiting refinement).
+    Written atomically so readers never see a partial file.
+    """
+    os.makedirs(job_path(job_id), exist_ok=True)
+    tmp_path = job_path(job_id, 'status.json.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(status, f, indent=2)
+    os.replace(tmp_path, job_path(job_id, 'status.json'))
+
+
+def read_status(job_id):
+    try:
+        with open(job_path(job_id, 'status.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
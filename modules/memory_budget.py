@@ -0,0 +1,263 @@
+import cv2
+import os
+import time
+import resource
+import threading
+from PIL import Image
+
+MEMORY_BUDGET_MB = int(os.environ.get('SOMA_MEMORY_BUDGET_MB', 256))  # Per job, on top of the server
+
+# Decode flags that let OpenCV decode straight to a reduced size
+_REDUCED_COLOR_FLAGS = {
+    1.0: cv2.IMREAD_COLOR,
+    0.5: cv2.IMREAD_REDUCED_COLOR_2,
+    0.25: cv2.IMREAD_REDUCED_COLOR_4,
+    0.125: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+# Plans from most to least memory hungry; the first that fits the budget is used
+PLANS = [
+    {'name': 'full', 'sequential': False, 'tiled': False, 'render_scale': 1.0, 'plot_dpi': 300, 'skip_optional': False},
+    {'name': 'sequential', 'sequential': True, 'tiled': False, 'render_scale': 1.0, 'plot_dpi': 300, 'skip_optional': False},
+    {'name': 'tiled', 'sequential': True, 'tiled': True, 'render_scale': 1.0, 'plot_dpi': 300, 'skip_optional': False},
+    {'name': 'downscaled', 'sequential': True, 'tiled': True, 'render_scale': 0.5, 'plot_dpi': 100, 'skip_optional': False},
+    {'name': 'minimal', 'sequential': True, 'tiled': True, 'render_scale': 0.25, 'plot_dpi': 100, 'skip_optional': True},
+]
+
+OVERHEAD = 1.3          # Contour lists, allocator slack and other temporaries
+JOB_FIXED_MB = 20       # Upload, data frames and heap growth that carries over between stages
+BGR_DECODE = 5.5        # Bytes per pixel while decoding a colour JPEG (RGB decode plus BGR copy)
+PLOT_FIXED_MB = 20      # Figure objects, KDE grid and font cache of one plot
+PLOT_CANVAS_COPIES = 2.5  # RGBA canvas plus the RGB copy and JPEG encoder buffers
+REPORT_MAX_SIDE = 1600  # Images are embedded in the PDF at about 300 dpi across the page
+REPORT_FIXED_MB = 10    # reportlab canvas, fonts and the embedded JPEG bytes
+INCREMENTAL_BYTES = 6   # BGR decode, then grey + reference + difference, then grey + blur + equalized
+MB = 1024 * 1024
+
+
+def current_rss_mb():
+    """
+    Resident memory of this process, from /proc where available.
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / MB
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _proportional_mb(pid):
+    """
+    Proportional set size of a process: pages shared with others (e.g. a forked
+    parent) are split between them, so the sizes of several processes add up.
+    Falls back to the resident size where smaps_rollup is unavailable.
+    """
+    try:
+        with open(f'/proc/{pid}/smaps_rollup', 'r') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, IndexError, ValueError):
+        pass
+    try:
+        with open(f'/proc/{pid}/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / MB
+    except (OSError, IndexError, ValueError):
+        return 0.0
+
+
+def process_tree(root_pid):
+    """
+    Returns the pid of a process followed by those of all its descendants,
+    read from /proc. Raises OSError where /proc is unavailable.
+    """
+    parents = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat', 'r') as f:
+                    # The command name may contain spaces, so split after its closing paren
+                    parents[int(entry)] = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+
+    tree, frontier = [root_pid], [root_pid]
+    while frontier:
+        pid = frontier.pop()
+        children = [child for child, parent in parents.items() if parent == pid]
+        tree.extend(children)
+        frontier.extend(children)
+    return tree
+
+
+def process_tree_mb(root_pid=None):
+    """
+    Memory of a process (this one by default) plus all its descendants, e.g.
+    a process pool running pipeline stages or gunicorn workers. Off Linux
+    this falls back to this process alone, or 0 for another root.
+    """
+    try:
+        tree = process_tree(root_pid or os.getpid())
+    except OSError:
+        return current_rss_mb() if root_pid is None else 0.0
+    return sum(_proportional_mb(pid) for pid in tree)
+
+
+def image_dimensions(image_path):
+    """
+    Reads the image size from the file header without decoding the pixels.
+    """
+    with Image.open(image_path) as img:
+        return img.size
+
+
+def _plot_mb(width_in, height_in, dpi):
+    return PLOT_FIXED_MB + width_in * height_in * dpi ** 2 * 4 * PLOT_CANVAS_COPIES / MB
+
+
+def bounded_scale(width, height, max_side):
+    """
+    Smallest reduced-decode scale (1, 1/2, 1/4 or 1/8) that keeps the longest
+    side at or above max_side, so the result only needs a small final resize.
+    """
+    for scale in sorted(_REDUCED_COLOR_FLAGS):
+        if max(width, height) * scale >= max_side:
+            return scale
+    return 1.0
+
+
+def _report_mb(width, height, plan, render_scale):
+    """
+    The PDF report decodes one image at a time, bounded by REPORT_MAX_SIDE,
+    and embeds it re-encoded as JPEG.
+    """
+    dpi = plan['plot_dpi']
+    overlay = (width * render_scale, height * render_scale)
+    images = [(width, height), overlay, overlay]
+    if not plan['skip_optional']:
+        images += [overlay, (10 * dpi, 8 * dpi), (12 * dpi, 10 * dpi)]
+    decoded = max(w * h * bounded_scale(w, h, REPORT_MAX_SIDE) ** 2 for w, h in images)
+    return REPORT_FIXED_MB + BGR_DECODE * decoded / MB
+
+
+def estimate_peak_mb(width, height, plan, incremental=False):
+    """
+    Estimates the peak memory one analysis adds on top of the running server,
+    from the bytes per pixel each stage holds at once. Stage costs were
+    measured in fresh processes on 4000x4000 and 8172x4596 JPEGs.
+    """
+    pixels = width * height / MB
+    render_scale = plan['render_scale']
+    overlay = BGR_DECODE * render_scale ** 2
+
+    # Decode + grey + blur + threshold; tiled decodes straight to grey (codec buffers
+    # included), keeps grey + blur and decodes the overlay afterwards
+    reduced = overlay if render_scale < 1 else 0
+    boulders = max(3, 2 + overlay) if plan['tiled'] else 6 + reduced
+    # BGR + grey/equalized + blur + edges + closed, overlay drawn in place
+    landslides = 2 + overlay if plan['tiled'] else 8 + reduced
+    detection = (max(boulders, landslides) if plan['sequential'] else boulders + landslides) * pixels * OVERHEAD
+    if incremental:
+        # Incremental runs draw full-size overlays, and fall back to the planned
+        # detection when they cannot register against the reference
+        detection = max(detection, INCREMENTAL_BYTES * pixels * OVERHEAD)
+        render_scale, overlay = 1.0, BGR_DECODE
+
+    # Matplotlib figures: 10x8 in (clusters) and 12x10 in (heatmap)
+    dpi = plan['plot_dpi']
+    cluster_plot = 0 if plan['skip_optional'] else _plot_mb(10, 8, dpi)
+    heatmap_plot = 0 if plan['skip_optional'] else _plot_mb(12, 10, dpi)
+    source_overlay = 0 if plan['skip_optional'] else overlay * pixels * OVERHEAD
+    consumers = max(heatmap_plot, source_overlay) if plan['sequential'] else heatmap_plot + source_overlay
+
+    # The report runs last, after the stages above have freed their buffers
+    report = _report_mb(width, height, plan, render_scale) * OVERHEAD
+
+    return round(JOB_FIXED_MB + max(detection, cluster_plot, consumers, report), 1)
+
+
+def plan_analysis(image_path, budget_mb=None, incremental=False):
+    """
+    Chooses the least degraded plan whose estimated peak fits the job's budget.
+    The budget excludes the server's own baseline memory. A requested
+    `budget_mb` (e.g. from the client) can only lower MEMORY_BUDGET_MB.
+    Falls back to the most frugal plan if nothing fits.
+    """
+    budget_mb = min(budget_mb, MEMORY_BUDGET_MB) if budget_mb and budget_mb > 0 else MEMORY_BUDGET_MB
+    width, height = image_dimensions(image_path)
+
+    for plan in PLANS:
+        estimate = estimate_peak_mb(width, height, plan, incremental)
+        if estimate <= budget_mb:
+            break
+    else:
+        print(f"[⚠️] No plan fits the {budget_mb} MB budget, using '{plan['name']}'")
+
+    print(f"[🧮] {width}x{height} image: plan '{plan['name']}', "
+          f"estimated peak {estimate} MB of {budget_mb} MB budget")
+    return dict(plan, budget_mb=budget_mb, estimated_peak_mb=estimate, width=width, height=height)
+
+
+def read_scaled(image_path, render_scale=1.0):
+    """
+    Decodes an image as BGR at a reduced scale (1, 1/2, 1/4 or 1/8) without
+    materialising the full-resolution pixels where the codec allows it.
+    """
+    img = cv2.imread(image_path, _REDUCED_COLOR_FLAGS[render_scale])
+    if img is None:
+        raise ValueError(f"Unable to read image from path: {image_path}")
+    return img
+
+
+def read_bounded(image_path, max_side):
+    """
+    Decodes an image as BGR with its longest side at most max_side, using a
+    reduced decode first so the full-resolution pixels are never held.
+    """
+    with Image.open(image_path) as img:
+        width, height = img.size
+    img = read_scaled(image_path, bounded_scale(width, height, max_side))
+    scale = max_side / max(img.shape[:2])
+    if scale < 1:
+        size = (max(1, round(img.shape[1] * scale)), max(1, round(img.shape[0] * scale)))
+        img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+    return img
+
+
+class MemoryMonitor:
+    """
+    Samples the memory of this process and its children (so process pool
+    workers count too) in a background thread and records the peak, so the
+    real cost of a job can be compared against its estimate.
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.baseline_mb = 0.0
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak_mb = max(self.peak_mb, process_tree_mb())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.baseline_mb = self.peak_mb = process_tree_mb()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, process_tree_mb())
+        return False
+
+    def summary(self):
+        return {
+            'baseline_mb': round(self.baseline_mb, 1),
+            'peak_mb': round(self.peak_mb, 1),
+            'job_peak_mb': round(self.peak_mb - self.baseline_mb, 1)
+        }
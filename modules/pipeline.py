@@ -0,0 +1,178 @@
+import math
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from modules.detect_boulders import detect_boulders
+from modules.detect_landslides import detect_landslides
+from modules.cluster_boulders import cluster_boulders
+from modules.generate_stats import generate_stats
+from modules.generate_heatmap import generate_heatmap
+from modules.estimate_source import estimate_source
+from modules.generate_pdf_report import generate_pdf
+from modules.generate_heatmap_json import generate_heatmap_json
+from modules.tiff_ingest import detect_boulders_tiff, detect_landslides_tiff
+
+PIPELINE_EXECUTOR = os.environ.get('SOMA_PIPELINE_EXECUTOR', 'thread')  # 'thread' or 'process'
+PIPELINE_WORKERS = int(os.environ.get('SOMA_PIPELINE_WORKERS', 4))
+
+# A pipeline step. `inputs` must exist before the stage can run; `optional_inputs`
+# are waited for but the stage still runs if their producer failed.
+Stage = namedtuple('Stage', ['name', 'func', 'args', 'inputs', 'outputs', 'optional_inputs', 'kwargs'],
+                   defaults=((), None))
+
+# Stages whose artifacts can be dropped when memory is tight
+OPTIONAL_STAGES = {'generate_heatmap', 'estimate_source'}
+
+# Stage functions that log and swallow their errors unless asked to raise them
+RAISE_ERRORS = {'raise_errors': True}
+
+
+def analysis_stages(image_path, detect=True, plan=None, tiff_preview=None):
+    """
+    Declares the analysis pipeline as stages with the artifacts they read and write.
+    Pass detect=False when detection artifacts already exist (e.g. an incremental run).
+    A memory `plan` from plan_analysis switches detection to tiles, renders
+    overlays and plots smaller, and can drop optional stages.
+    With `tiff_preview` (from write_preview), image_path is a TIFF read window
+    by window and overlays are drawn on the preview.
+    """
+    plan = plan or {}
+    detection = {'tiled': plan.get('tiled', False), 'render_scale': plan.get('render_scale', 1.0)}
+    dpi = plan.get('plot_dpi', 300)
+
+    stages = []
+    if not detect:
+        # Incremental runs draw their overlays at full size, whatever the plan
+        detection['render_scale'] = 1.0
+    elif tiff_preview:
+        lo, hi = tiff_preview['display_range']
+        detection['render_scale'] = tiff_preview['scale']
+        stages += [
+            Stage('detect_boulders', detect_boulders_tiff, (image_path, tiff_preview['path']),
+                  inputs=[], outputs=['boulder_data.csv', 'boulder_candidates.csv', 'boulders_detected.jpg'],
+                  kwargs={'brightness_range': None if (lo, hi) == (0, 255) else (lo, hi)}),
+            Stage('detect_landslides', detect_landslides_tiff, (image_path, tiff_preview['path']),
+                  inputs=[], outputs=['landslides_detected.jpg', 'landslide_data.json']),
+        ]
+    else:
+        stages += [
+            Stage('detect_boulders', detect_boulders, (image_path,),
+                  inputs=[], outputs=['boulder_data.csv', 'boulder_candidates.csv', 'boulders_detected.jpg'],
+                  kwargs=detection),
+            Stage('detect_landslides', detect_landslides, (image_path,),
+                  inputs=[], outputs=['landslides_detected.jpg', 'landslide_data.json'],
+                  kwargs=dict(detection, **RAISE_ERRORS)),
+        ]
+    plot = not plan.get('skip_optional', False)
+    stages += [
+        Stage('cluster_boulders', cluster_boulders, (),
+              inputs=['boulder_data.csv'],
+              outputs=['boulder_data_clustered.csv'] + (['clustered_boulders_plot.jpg'] if plot else []),
+              kwargs={'plot': plot, 'dpi': dpi}),
+        Stage('generate_stats', generate_stats, (),
+              inputs=['boulder_data.csv'], outputs=['stats_summary.txt'],
+              kwargs=RAISE_ERRORS),
+        Stage('generate_heatmap', generate_heatmap, (),
+              inputs=['boulder_data_clustered.csv'], outputs=['risk_heatmap.jpg'],
+              kwargs=dict(dpi=dpi, **RAISE_ERRORS)),
+        Stage('estimate_source', estimate_source, (),
+              inputs=['boulder_data_clustered.csv', 'boulders_detected.jpg'], outputs=['boulders_with_source.jpg'],
+              kwargs={'render_scale': detection['render_scale']}),
+        Stage('generate_heatmap_json', generate_heatmap_json, (),
+              inputs=['boulder_data_clustered.csv'], outputs=['boulder_points.json'],
+              kwargs=RAISE_ERRORS),
+        # The report renders whatever images exist, so it only waits for them
+        Stage('generate_pdf', generate_pdf, (),
+              inputs=[], outputs=['report.pdf'],
+              optional_inputs=['stats_summary.txt', 'boulders_detected.jpg', 'landslides_detected.jpg',
+                               'clustered_boulders_plot.jpg', 'risk_heatmap.jpg', 'boulders_with_source.jpg'],
+              kwargs=RAISE_ERRORS),
+    ]
+
+    if plan.get('skip_optional'):
+        stages = [stage for stage in stages if stage.name not in OPTIONAL_STAGES]
+    return stages
+
+
+def _run_stage(func, args, kwargs, outputs, output_folder):
+    started = time.time()
+    start = time.perf_counter()
+    value = func(*args, **(kwargs or {}))
+    seconds = time.perf_counter() - start
+
+    # Some stages only log their errors, so also check they wrote what they declare.
+    # mtime is compared to the whole second for filesystems that store no more
+    missing = []
+    for output in outputs:
+        path = os.path.join(output_folder, output)
+        if not os.path.exists(path) or os.path.getmtime(path) < math.floor(started):
+            missing.append(output)
+    if missing:
+        raise RuntimeError(f"Stage did not write its outputs: {', '.join(missing)}")
+    return value, seconds
+
+
+def run_pipeline(stages, executor=None, max_workers=None, output_folder='static'):
+    """
+    Runs stages concurrently as soon as the stages producing their inputs have
+    finished. Inputs that no stage produces are assumed to exist already.
+    A stage fails if it raises or does not (re)write its outputs in output_folder;
+    a failed stage only skips the stages that need its outputs.
+
+    Returns:
+        dict: Per-stage {'status', 'seconds', 'error', 'value'}, in declaration order.
+    """
+    executor = executor or PIPELINE_EXECUTOR
+    pool_class = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+
+    producers = {output: stage.name for stage in stages for output in stage.outputs}
+    required = {s.name: {producers[i] for i in s.inputs if i in producers} for s in stages}
+    waits_for = {s.name: required[s.name] | {producers[i] for i in s.optional_inputs if i in producers}
+                 for s in stages}
+
+    results = {}
+    pending = {stage.name: stage for stage in stages}
+    running = {}
+
+    with pool_class(max_workers=max_workers or PIPELINE_WORKERS) as pool:
+        while pending or running:
+            # Step 1: Start (or skip) every stage whose dependencies have settled
+            progressed = True
+            while progressed:
+                progressed = False
+                for name, stage in list(pending.items()):
+                    if not waits_for[name].issubset(results):
+                        continue
+                    del pending[name]
+                    progressed = True
+
+                    failed = sorted(d for d in required[name] if results[d]['status'] != 'success')
+                    if failed:
+                        results[name] = {'status': 'skipped', 'seconds': 0.0,
+                                         'error': f"Upstream stage failed: {', '.join(failed)}", 'value': None}
+                        print(f"[⏭️] Skipped {name}: upstream {', '.join(failed)} failed")
+                        continue
+
+                    running[pool.submit(_run_stage, stage.func, stage.args, stage.kwargs,
+                                        stage.outputs, output_folder)] = name
+
+            if not running:
+                if pending:
+                    raise ValueError(f"Pipeline has unsatisfiable dependencies: {', '.join(pending)}")
+                break
+
+            # Step 2: Collect whichever stages finish first
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    value, seconds = future.result()
+                    results[name] = {'status': 'success', 'seconds': round(seconds, 3), 'error': None, 'value': value}
+                    print(f"[⏱️] {name} finished in {seconds:.2f}s")
+                except Exception as e:
+                    results[name] = {'status': 'failed', 'seconds': 0.0, 'error': str(e), 'value': None}
+                    print(f"[💥] Stage {name} failed: {str(e)}")
+
+    return {stage.name: results[stage.name] for stage in stages}
@@ -0,0 +1,83 @@
+import cv2
+import os
+
+from modules.detect_boulders import extract_candidates, filter_candidates
+from modules.cluster_boulders import cluster_boulders
+from modules.generate_stats import generate_stats
+from modules.generate_heatmap_json import generate_heatmap_json
+from modules.memory_budget import image_dimensions
+from modules.pipeline import RAISE_ERRORS, Stage
+
+QUICKLOOK_MAX_SIDE = int(os.environ.get('SOMA_QUICKLOOK_MAX_SIDE', 1024))
+
+# Decode flags that let OpenCV decode straight to a decimated grayscale image
+_REDUCED_GRAYSCALE_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8
+}
+
+
+def decimation_factor(width, height, max_side=QUICKLOOK_MAX_SIDE):
+    """
+    Smallest supported decimation (1, 2, 4 or 8) that brings the image within max_side.
+    """
+    for factor in sorted(_REDUCED_GRAYSCALE_FLAGS):
+        if max(width, height) / factor <= max_side:
+            return factor
+    return max(_REDUCED_GRAYSCALE_FLAGS)
+
+
+def detect_boulders_quicklook(image_path, output_csv='static/boulder_data.csv', full_width=None):
+    """
+    Runs boulder detection on a decimated copy of the image and rescales the
+    coordinates and sizes back to full resolution. Boulders smaller than a few
+    decimated pixels are missed, so counts are approximate.
+    Pass `full_width` when image_path is itself a downscaled preview.
+
+    Returns:
+        float: The overall decimation factor relative to full resolution.
+    """
+    # Step 1: Decode straight to a decimated grayscale image
+    width, height = image_dimensions(image_path)
+    decode_factor = decimation_factor(width, height)
+    gray = cv2.imread(image_path, _REDUCED_GRAYSCALE_FLAGS[decode_factor])
+    if gray is None:
+        raise ValueError("Image not found or unable to read.")
+    factor = (full_width or width) / gray.shape[1]
+
+    # Step 2: Same preprocessing as detect_boulders, with the blur scaled down
+    ksize = max(3, round(11 / factor) | 1)
+    blurred = cv2.GaussianBlur(gray, (ksize, ksize), 0)
+    otsu_value, _ = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+    # Step 3: Rescale candidate features to full resolution before filtering
+    candidates = extract_candidates(gray, blurred, otsu_value)
+    candidates[['X', 'Y', 'Radius', 'Perimeter']] *= factor
+    candidates['Area'] *= factor ** 2
+    df = filter_candidates(candidates)
+
+    os.makedirs(os.path.dirname(output_csv), exist_ok=True)
+    df.to_csv(output_csv, index=False)
+    factor = round(factor, 2)
+    print(f"[⚡] Quick-look found {len(df)} boulders at 1/{factor} resolution")
+    return factor
+
+
+def quicklook_stages(image_path, full_width=None):
+    """
+    Declares the quick-look pipeline: decimated detection, clustering without
+    the plot, stats and the Leaflet heatmap points.
+    """
+    return [
+        Stage('detect_boulders', detect_boulders_quicklook, (image_path,),
+              inputs=[], outputs=['boulder_data.csv'], kwargs={'full_width': full_width}),
+        Stage('cluster_boulders', cluster_boulders, (),
+              inputs=['boulder_data.csv'], outputs=['boulder_data_clustered.csv'],
+              kwargs={'plot': False}),
+        Stage('generate_stats', generate_stats, (),
+              inputs=['boulder_data.csv'], outputs=['stats_summary.txt'], kwargs=RAISE_ERRORS),
+        Stage('generate_heatmap_json', generate_heatmap_json, (),
+              inputs=['boulder_data_clustered.csv'], outputs=['boulder_points.json'], kwargs=RAISE_ERRORS),
+    ]
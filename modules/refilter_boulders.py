@@ -0,0 +1,72 @@
+import cv2
+import pandas as pd
+import os
+import time
+
+from modules.detect_boulders import DEFAULT_THRESHOLDS, filter_candidates, draw_boulders
+from modules.cluster_boulders import cluster_boulders
+from modules.generate_stats import generate_stats
+from modules.generate_heatmap_json import generate_heatmap_json
+from modules.job_store import job_path, load_meta
+
+# Rendered from the previous boulder table; re-filtering does not redraw them
+STALE_ARTIFACTS = ['clustered_boulders_plot.jpg', 'risk_heatmap.jpg', 'boulders_with_source.jpg', 'report.pdf']
+
+
+def parse_thresholds(thresholds):
+    """
+    Validates user-supplied thresholds against DEFAULT_THRESHOLDS.
+    Raises ValueError for a non-object, unknown names or non-numeric values.
+    """
+    thresholds = thresholds or {}
+    if not isinstance(thresholds, dict):
+        raise ValueError("Thresholds must be an object of name: value pairs.")
+    unknown = set(thresholds) - set(DEFAULT_THRESHOLDS)
+    if unknown:
+        raise ValueError(f"Unknown thresholds: {', '.join(sorted(unknown))}")
+    try:
+        return {name: float(value) for name, value in thresholds.items()}
+    except (TypeError, ValueError):
+        raise ValueError("Threshold values must be numbers.")
+
+
+def refilter_boulders(job_id, thresholds=None, render=False, output_folder='static'):
+    """
+    Re-applies detection thresholds to a job's stored candidate table and
+    recomputes clustering, stats and heatmap points without touching the image.
+    Pass render=True to also redraw the detected boulders overlay.
+    Results go to the static folder, so only the current job should be re-filtered.
+    """
+    start = time.perf_counter()
+
+    # Step 1: Filter the stored candidates with the new thresholds
+    candidates = pd.read_csv(job_path(job_id, 'boulder_candidates.csv'))
+    df = filter_candidates(candidates, thresholds)
+
+    output_csv = os.path.join(output_folder, 'boulder_data.csv')
+    df.to_csv(output_csv, index=False)
+    print(f"[🎚️] Re-filtered {len(candidates)} candidates to {len(df)} boulders")
+
+    # Step 2: Recompute downstream results; a failure surfaces as an error
+    # rather than leaving the previous table's stats or points in place
+    cluster_boulders(output_csv, plot=False)
+    generate_stats(raise_errors=True)
+    generate_heatmap_json(raise_errors=True)
+
+    # Step 3: Optionally redraw the overlay from the stored source image
+    if render:
+        meta = load_meta(job_id)
+        img = cv2.imread(job_path(job_id, meta['source']))
+        if img is not None:
+            overlay = draw_boulders(img, df, meta.get('source_scale', 1.0))
+            cv2.imwrite(os.path.join(output_folder, 'boulders_detected.jpg'), overlay)
+    stale = STALE_ARTIFACTS if render else ['boulders_detected.jpg'] + STALE_ARTIFACTS
+
+    return {
+        'boulder_count': len(df),
+        'candidate_count': len(candidates),
+        'shape_counts': {shape: int(n) for shape, n in df['ShapeType'].value_counts().items()},
+        'thresholds': dict(DEFAULT_THRESHOLDS, **(thresholds or {})),
+        'stale_artifacts': stale,
+        'elapsed_ms': round((time.perf_counter() - start) * 1000, 1)
+    }
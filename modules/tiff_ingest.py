@@ -0,0 +1,191 @@
+import cv2
+import numpy as np
+import pandas as pd
+import math
+import os
+
+from modules.detect_boulders import (
+    CANDIDATE_COLUMNS, TILE_SIZE, TILE_MARGIN, extract_candidates, filter_candidates, draw_boulders
+)
+from modules.detect_landslides import TILE_MARGIN as LANDSLIDE_MARGIN, find_landslides, save_landslide_data
+from modules.tiff_reader import TiffReader, UnsupportedTiff
+from modules.tiling import iter_tiles, local_rect
+
+PREVIEW_MAX_SIDE = int(os.environ.get('SOMA_PREVIEW_MAX_SIDE', 4096))
+STRETCH_PERCENTILES = (0.5, 99.5)  # Display stretch for 16-bit previews and brightness
+
+
+def open_tiff(tiff_path):
+    """
+    Opens a TIFF for windowed reading, or returns None if it needs a full decode.
+    """
+    try:
+        return TiffReader(tiff_path)
+    except UnsupportedTiff as e:
+        print(f"[ℹ️] Falling back to full TIFF conversion: {e}")
+        return None
+
+
+def display_range(pixels):
+    """
+    Intensity range mapped onto 0-255: the full range for 8-bit data, a
+    percentile stretch for 16-bit data.
+    """
+    if pixels.dtype == np.uint8:
+        return 0, 255
+    lo, hi = np.percentile(pixels, STRETCH_PERCENTILES)
+    return float(lo), float(max(hi, lo + 1))
+
+
+def to_uint8(pixels, lo, hi):
+    scaled = (pixels.astype(np.float32) - lo) * (255 / (hi - lo))
+    return np.clip(scaled, 0, 255).astype(np.uint8)
+
+
+def write_preview(reader, preview_path='static/preview.jpg', max_side=PREVIEW_MAX_SIDE):
+    """
+    Writes an 8-bit preview no larger than max_side, built window by window.
+
+    Returns:
+        dict: Preview path, its scale relative to the TIFF, the TIFF size and
+        the display range used for the stretch.
+    """
+    factor = max(1, math.ceil(max(reader.width, reader.height) / max_side))
+    preview = reader.read_decimated(factor)
+    lo, hi = display_range(preview)
+
+    os.makedirs(os.path.dirname(preview_path), exist_ok=True)
+    cv2.imwrite(preview_path, to_uint8(preview, lo, hi))
+    print(f"[🖼️] {reader.width}x{reader.height} {reader.dtype.itemsize * 8}-bit TIFF, "
+          f"preview at 1/{factor} saved to: {preview_path}")
+    return {
+        'path': preview_path,
+        'scale': 1 / factor,
+        'width': reader.width,
+        'height': reader.height,
+        'display_range': (lo, hi)
+    }
+
+
+def _histograms(reader, margin, blur=None):
+    """
+    Histogram of every tile core, optionally after blurring the tile with its margin.
+    """
+    levels = np.iinfo(reader.dtype).max + 1
+    hist = np.zeros(levels, dtype=np.int64)
+    for core, region in iter_tiles(reader.height, reader.width, TILE_SIZE, margin):
+        pixels = reader.read_window(*region)
+        if blur:
+            pixels = cv2.GaussianBlur(pixels, blur, 0)
+        x0, y0, x1, y1 = local_rect(core, region)
+        hist += np.bincount(pixels[y0:y1, x0:x1].ravel(), minlength=levels)
+    return hist
+
+
+def otsu_threshold(hist):
+    """
+    Otsu's threshold computed from a histogram of any bit depth; pixels above it
+    are foreground, as with cv2.THRESH_OTSU.
+    """
+    hist = hist.astype(np.float64)
+    levels = np.arange(len(hist))
+    weight_low = np.cumsum(hist)
+    weight_high = weight_low[-1] - weight_low
+    cumulative = np.cumsum(hist * levels)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_low = cumulative / weight_low
+        mean_high = (cumulative[-1] - cumulative) / weight_high
+        between = weight_low * weight_high * (mean_low - mean_high) ** 2
+    return int(np.nanargmax(between)) if np.isfinite(between).any() else 0
+
+
+def equalization_lut(hist):
+    """
+    Lookup table equivalent to cv2.equalizeHist for a histogram of any bit depth.
+    """
+    cdf = np.cumsum(hist)
+    cdf_min = cdf[np.nonzero(hist)[0][0]]
+    scale = 255 / max(cdf[-1] - cdf_min, 1)
+    return np.clip(np.rint((cdf - cdf_min) * scale), 0, 255).astype(np.uint8)
+
+
+def detect_boulders_tiff(tiff_path, preview_path='static/preview.jpg', brightness_range=None):
+    """
+    Detects boulders in a TIFF one window at a time, thresholding at the
+    file's own bit depth. `brightness_range` maps 16-bit brightness onto the
+    0-255 scale of the filters. The overlay is drawn on the preview.
+    """
+    reader = TiffReader(tiff_path)
+
+    # Step 1: Otsu's threshold over the whole blurred image, from tile histograms
+    otsu_value = otsu_threshold(_histograms(reader, TILE_MARGIN, blur=(11, 11)))
+
+    # Step 2: Contour detection and feature extraction per window
+    tiles = [pd.DataFrame(columns=CANDIDATE_COLUMNS)]
+    for core, region in iter_tiles(reader.height, reader.width, TILE_SIZE, TILE_MARGIN):
+        gray = reader.read_window(*region)
+        blurred = cv2.GaussianBlur(gray, (11, 11), 0)
+        tiles.append(extract_candidates(
+            gray, blurred, otsu_value, offset=region[:2],
+            core=local_rect(core, region), brightness_range=brightness_range
+        ))
+    candidates = pd.concat(tiles, ignore_index=True).astype(float)
+    df = filter_candidates(candidates)
+
+    # Step 3: Save output, drawing on the preview
+    os.makedirs('static', exist_ok=True)
+    candidates_csv = 'static/boulder_candidates.csv'
+    candidates.to_csv(candidates_csv, index=False)
+    print(f"[✅] {len(candidates)} boulder candidates saved to: {candidates_csv}")
+
+    img = cv2.imread(preview_path)
+    if img is None:
+        raise ValueError(f"Unable to read preview from path: {preview_path}")
+    detected_image_path = 'static/boulders_detected.jpg'
+    cv2.imwrite(detected_image_path, draw_boulders(img, df, img.shape[1] / reader.width))
+    print(f"[✅] Detected boulders image saved to: {detected_image_path}")
+
+    output_csv = 'static/boulder_data.csv'
+    df.to_csv(output_csv, index=False)
+    print(f"[✅] Boulder data saved to: {output_csv}")
+
+    return output_csv
+
+
+def detect_landslides_tiff(tiff_path, preview_path='static/preview.jpg'):
+    """
+    Detects landslides in a TIFF one window at a time. Equalization uses a
+    lookup table built from the histogram of the whole file, so every window
+    is equalized exactly as the full image would be.
+    Contours are still traced per TILE_SIZE window with a LANDSLIDE_MARGIN
+    border, so a region wider than the margin that crosses a tile edge can be
+    split or clipped, and counts may differ slightly from a full-frame run.
+    """
+    reader = TiffReader(tiff_path)
+    lut = equalization_lut(_histograms(reader, 0))
+
+    landslide_candidates, landslide_contours = [], []
+    for core, region in iter_tiles(reader.height, reader.width, TILE_SIZE, LANDSLIDE_MARGIN):
+        equalized = lut[reader.read_window(*region)]
+        tile_candidates, tile_contours = find_landslides(
+            equalized, offset=region[:2], core=local_rect(core, region)
+        )
+        landslide_candidates += tile_candidates
+        landslide_contours += tile_contours
+
+    landslide_img = cv2.imread(preview_path)
+    if landslide_img is None:
+        raise ValueError(f"Unable to read preview from path: {preview_path}")
+    scale = landslide_img.shape[1] / reader.width
+    drawn_contours = [(cnt * scale).astype(np.int32) for cnt in landslide_contours]
+    if drawn_contours:
+        cv2.drawContours(landslide_img, drawn_contours, -1, (255, 0, 0), 2)
+
+    os.makedirs('static', exist_ok=True)
+    output_path = 'static/landslides_detected.jpg'
+    cv2.imwrite(output_path, landslide_img)
+    save_landslide_data(landslide_candidates, landslide_contours)
+
+    print(f" Landslides detected and saved to {output_path}")
+    print(f"Total landslide candidates detected: {len(landslide_candidates)}")
+    return landslide_candidates
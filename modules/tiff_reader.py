@@ -0,0 +1,219 @@
+import math
+import struct
+import numpy as np
+import cv2
+
+# TIFF field types we need to decode, as numpy type codes
+_FIELD_TYPES = {1: 'u1', 3: 'u2', 4: 'u4', 6: 'i1', 8: 'i2', 9: 'i4', 16: 'u8', 17: 'i8'}
+_FIELD_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 16: 8, 17: 8, 18: 8}
+
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+PHOTOMETRIC = 262
+STRIP_OFFSETS = 273
+SAMPLES_PER_PIXEL = 277
+ROWS_PER_STRIP = 278
+STRIP_BYTE_COUNTS = 279
+PLANAR_CONFIGURATION = 284
+TILE_WIDTH = 322
+TILE_LENGTH = 323
+TILE_OFFSETS = 324
+TILE_BYTE_COUNTS = 325
+SAMPLE_FORMAT = 339
+
+# (SampleFormat, BitsPerSample) -> pixel dtype; detection works on 8 and 16-bit unsigned data
+_PIXEL_TYPES = {(1, 8): 'u1', (1, 16): 'u2'}
+
+
+class UnsupportedTiff(ValueError):
+    """
+    Raised for TIFFs this reader cannot window-read (e.g. compressed ones);
+    callers fall back to decoding the whole file with PIL.
+    """
+
+
+def is_tiff(path):
+    return path.lower().endswith(('.tif', '.tiff'))
+
+
+class TiffReader:
+    """
+    Reads windows of uncompressed, striped or tiled TIFF and BigTIFF rasters
+    through a memory map, so only the pixels of the requested window are paged in.
+    Windows are returned as grayscale in the file's own bit depth.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            tags = self._read_first_ifd(f)
+        self._configure(tags)
+        self._data = np.memmap(path, dtype=np.uint8, mode='r')
+        self._check_bounds()
+
+    # Parsing
+
+    @staticmethod
+    def _read(f, size):
+        raw = f.read(size)
+        if len(raw) < size:
+            raise UnsupportedTiff("TIFF header is truncated")
+        return raw
+
+    def _read_first_ifd(self, f):
+        byte_order = f.read(2)
+        if byte_order not in (b'II', b'MM'):
+            raise UnsupportedTiff("Not a TIFF file")
+        self.endian = '<' if byte_order == b'II' else '>'
+        e = self.endian
+
+        version = struct.unpack(e + 'H', self._read(f, 2))[0]
+        if version == 42:
+            big, offset_format, count_format = False, 'I', 'H'
+            ifd_offset = struct.unpack(e + 'I', self._read(f, 4))[0]
+        elif version == 43:
+            big, offset_format, count_format = True, 'Q', 'Q'
+            self._read(f, 4)  # Offset byte size (8) and padding
+            ifd_offset = struct.unpack(e + 'Q', self._read(f, 8))[0]
+        else:
+            raise UnsupportedTiff(f"Unknown TIFF version: {version}")
+
+        entry_size, inline_size = (20, 8) if big else (12, 4)
+        f.seek(ifd_offset)
+        entry_count = struct.unpack(e + count_format, self._read(f, struct.calcsize(count_format)))[0]
+        entries = self._read(f, entry_count * entry_size)
+
+        tags = {}
+        for i in range(entry_count):
+            entry = entries[i * entry_size:(i + 1) * entry_size]
+            tag, field_type = struct.unpack(e + 'HH', entry[:4])
+            if field_type not in _FIELD_TYPES:
+                continue
+            count = struct.unpack(e + offset_format, entry[4:4 + struct.calcsize(offset_format)])[0]
+            value = entry[4 + struct.calcsize(offset_format):]
+
+            size = count * _FIELD_SIZES[field_type]
+            if size <= inline_size:
+                raw = value[:size]
+            else:
+                f.seek(struct.unpack(e + offset_format, value)[0])
+                raw = self._read(f, size)
+            tags[tag] = np.frombuffer(raw, dtype=e + _FIELD_TYPES[field_type]).astype(np.int64)
+        return tags
+
+    def _configure(self, tags):
+        def scalar(tag, default=None):
+            if tag in tags:
+                return int(tags[tag][0])
+            if default is None:
+                raise UnsupportedTiff(f"Missing required TIFF tag {tag}")
+            return default
+
+        self.width = scalar(IMAGE_WIDTH)
+        self.height = scalar(IMAGE_LENGTH)
+        self.samples = scalar(SAMPLES_PER_PIXEL, 1)
+
+        compression = scalar(COMPRESSION, 1)
+        if compression != 1:
+            raise UnsupportedTiff(f"Compressed TIFF (scheme {compression})")
+        if self.samples > 1 and scalar(PLANAR_CONFIGURATION, 1) != 1:
+            raise UnsupportedTiff("Planar (band-separate) TIFF")
+        photometric = scalar(PHOTOMETRIC, 1)
+        if photometric not in (1, 2):
+            raise UnsupportedTiff(f"Unsupported photometric interpretation {photometric}")
+
+        bits = set(tags[BITS_PER_SAMPLE].tolist()) if BITS_PER_SAMPLE in tags else {1}
+        sample_format = set(tags[SAMPLE_FORMAT].tolist()) if SAMPLE_FORMAT in tags else {1}
+        if len(bits) != 1 or len(sample_format) != 1:
+            raise UnsupportedTiff("Mixed sample types")
+        key = (sample_format.pop(), bits.pop())
+        if key not in _PIXEL_TYPES:
+            raise UnsupportedTiff(f"Unsupported sample format/bit depth {key}")
+        self.file_dtype = np.dtype(self.endian + _PIXEL_TYPES[key])
+        self.dtype = self.file_dtype.newbyteorder('=')
+
+        if TILE_OFFSETS in tags:
+            self.tiled = True
+            self.block_width = scalar(TILE_WIDTH)
+            self.block_height = scalar(TILE_LENGTH)
+            offsets_tag, byte_counts_tag = TILE_OFFSETS, TILE_BYTE_COUNTS
+            self.blocks_across = math.ceil(self.width / self.block_width)
+        elif STRIP_OFFSETS in tags:
+            self.tiled = False
+            self.block_width = self.width
+            self.block_height = min(scalar(ROWS_PER_STRIP, self.height), self.height)
+            offsets_tag, byte_counts_tag = STRIP_OFFSETS, STRIP_BYTE_COUNTS
+            self.blocks_across = 1
+        else:
+            raise UnsupportedTiff("TIFF has neither strips nor tiles")
+        if byte_counts_tag not in tags:
+            raise UnsupportedTiff(f"Missing required TIFF tag {byte_counts_tag}")
+        self.offsets = tags[offsets_tag]
+        self.byte_counts = tags[byte_counts_tag]
+
+    def _check_bounds(self):
+        blocks = self.blocks_across * math.ceil(self.height / self.block_height)
+        if len(self.offsets) < blocks or len(self.byte_counts) < blocks:
+            raise UnsupportedTiff("TIFF block table is incomplete")
+        offsets, byte_counts = self.offsets[:blocks], self.byte_counts[:blocks]
+
+        # Every block must hold all its pixels; the last strip may be short, tiles are always full size
+        rows = np.full(blocks, self.block_height, dtype=np.int64)
+        if not self.tiled:
+            rows[-1] = self.height - (blocks - 1) * self.block_height
+        row_bytes = self.block_width * self.samples * self.file_dtype.itemsize
+        if (byte_counts < rows * row_bytes).any():
+            raise UnsupportedTiff("TIFF blocks are smaller than their pixels")
+        if (offsets < 0).any() or (offsets + byte_counts > len(self._data)).any():
+            raise UnsupportedTiff("TIFF is truncated")
+
+    # Reading
+
+    def _block(self, index, rows):
+        return np.ndarray(
+            (rows, self.block_width, self.samples), dtype=self.file_dtype,
+            buffer=self._data, offset=int(self.offsets[index])
+        )
+
+    def read_window(self, x0, y0, x1, y1):
+        """
+        Returns the grayscale pixels of [y0:y1, x0:x1] in the file's bit depth.
+        """
+        x0, y0 = max(0, x0), max(0, y0)
+        x1, y1 = min(self.width, x1), min(self.height, y1)
+        out = np.empty((y1 - y0, x1 - x0, self.samples), dtype=self.dtype)
+
+        bw, bh = self.block_width, self.block_height
+        for by in range(y0 // bh, (y1 - 1) // bh + 1):
+            top = by * bh
+            rows = bh if self.tiled else min(bh, self.height - top)
+            for bx in range(x0 // bw, (x1 - 1) // bw + 1):
+                left = bx * bw
+                block = self._block(by * self.blocks_across + bx, rows)
+                r0, r1 = max(y0, top), min(y1, top + rows)
+                c0, c1 = max(x0, left), min(x1, left + bw)
+                out[r0 - y0:r1 - y0, c0 - x0:c1 - x0] = block[r0 - top:r1 - top, c0 - left:c1 - left]
+
+        if self.samples == 1 or self.samples == 2:  # Grey, or grey + alpha
+            return out[:, :, 0]
+        # RGB(A) -> luma with the same weights as cv2.COLOR_RGB2GRAY
+        gray = out[:, :, 0] * 0.299 + out[:, :, 1] * 0.587 + out[:, :, 2] * 0.114
+        return np.rint(gray).astype(self.dtype)
+
+    def read_decimated(self, factor, window=256):
+        """
+        Area-averages the whole raster down by an integer factor, one window at
+        a time, so memory stays bounded by the output size.
+        """
+        out = np.empty((math.ceil(self.height / factor), math.ceil(self.width / factor)), dtype=self.dtype)
+        step = window * factor
+        for y0 in range(0, self.height, step):
+            for x0 in range(0, self.width, step):
+                block = self.read_window(x0, y0, x0 + step, y0 + step)
+                size = (math.ceil(block.shape[1] / factor), math.ceil(block.shape[0] / factor))
+                if factor > 1:
+                    block = cv2.resize(block, size, interpolation=cv2.INTER_AREA)
+                out[y0 // factor:y0 // factor + size[1], x0 // factor:x0 // factor + size[0]] = block
+        return out
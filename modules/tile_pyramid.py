@@ -0,0 +1,211 @@
+import cv2
+import os
+import math
+import hashlib
+import threading
+from collections import OrderedDict
+
+from modules.memory_budget import image_dimensions, read_scaled
+
+TILE_SIZE = 256
+TILE_CACHE_MB = int(os.environ.get('SOMA_TILE_CACHE_MB', 64))  # Pyramid levels and encoded tiles
+JPEG_QUALITY = 85
+MAX_DECODE_REDUCTION = 3  # Levels down to 1/8 are decoded directly, smaller ones halved from above
+
+# Images that can be viewed as a pyramid, by the name used in tile URLs
+PYRAMID_IMAGES = {
+    'preview': 'preview.jpg',
+    'boulders_detected': 'boulders_detected.jpg',
+    'landslides_detected': 'landslides_detected.jpg',
+    'boulders_with_source': 'boulders_with_source.jpg',
+    'clustered_boulders_plot': 'clustered_boulders_plot.jpg',
+    'risk_heatmap': 'risk_heatmap.jpg'
+}
+
+
+def image_version(path):
+    """
+    Returns a short content version for an image file, derived from its
+    modification time and size. Changes whenever the file is rewritten.
+    """
+    stat = os.stat(path)
+    return hashlib.md5(f"{path}:{stat.st_mtime_ns}:{stat.st_size}".encode()).hexdigest()[:16]
+
+
+def max_level(width, height):
+    """
+    DeepZoom numbering: level 0 is 1x1 px, the top level is full resolution.
+    """
+    return max(0, math.ceil(math.log2(max(width, height))))
+
+
+class ByteCache:
+    """
+    Thread-safe LRU cache bounded by the total size of its values in bytes.
+    Values larger than the whole budget are not cached.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key][0]
+
+    def put(self, key, value, nbytes):
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self.size -= self._items.pop(key)[1]
+            self._items[key] = (value, nbytes)
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                self.size -= self._items.popitem(last=False)[1][1]
+
+
+_cache = ByteCache(TILE_CACHE_MB * 1024 * 1024)
+
+# Decoded levels above this size are cached as tile-row bands instead of whole
+LEVEL_MAX_BYTES = _cache.max_bytes // 4
+BAND_CACHE_BYTES = _cache.max_bytes // 2  # Bands kept from one decode of a large level
+
+# Serialises decodes of large levels, so the parallel tile requests of one
+# screen wait for a single decode instead of each decoding the image
+_band_lock = threading.Lock()
+
+
+def _dimensions(path, version):
+    key = ('size', path, version)
+    size = _cache.get(key)
+    if size is None:
+        size = image_dimensions(path)
+        _cache.put(key, size, 64)
+    return size
+
+
+def _level_image(path, version, level, top):
+    """
+    Returns one pyramid level as a BGR image. Levels down to 1/8 scale are
+    decoded at reduced size straight from the JPEG; smaller levels are built
+    by halving the level above, so each level is produced once per version.
+    Levels too large to cache whole are served by _level_band instead.
+    """
+    key = ('level', path, version, level)
+    img = _cache.get(key)
+    if img is not None:
+        return img
+
+    reduction = top - level
+    if reduction <= MAX_DECODE_REDUCTION:
+        img = read_scaled(path, 1 / 2 ** reduction)
+    else:
+        above = _level_image(path, version, level + 1, top)
+        size = (math.ceil(above.shape[1] / 2), math.ceil(above.shape[0] / 2))
+        img = cv2.resize(above, size, interpolation=cv2.INTER_AREA)
+
+    _cache.put(key, img, img.nbytes)
+    return img
+
+
+def _level_band(path, version, level, top, row):
+    """
+    Returns one TILE_SIZE-row band of a level too large to cache whole.
+    A miss decodes the level once and caches the bands nearest `row`, up to
+    BAND_CACHE_BYTES, so the tiles around it are cut without decoding again.
+    Returns None past the last band.
+    """
+    key = ('band', path, version, level, row)
+    band = _cache.get(key)
+    if band is not None:
+        return band
+
+    with _band_lock:
+        # Another request may have decoded the level while this one waited
+        band = _cache.get(key)
+        if band is not None:
+            return band
+
+        img = read_scaled(path, 1 / 2 ** (top - level))
+        rows = math.ceil(img.shape[0] / TILE_SIZE)
+        if row >= rows:
+            return None
+
+        budget = BAND_CACHE_BYTES
+        for r in sorted(range(rows), key=lambda r: abs(r - row)):
+            # Copies, so the decoded level is released once this returns
+            strip = img[r * TILE_SIZE:(r + 1) * TILE_SIZE].copy()
+            if r == row:
+                band = strip
+            elif strip.nbytes > budget:
+                break
+            budget -= strip.nbytes
+            _cache.put(('band', path, version, level, r), strip, strip.nbytes)
+    return band
+
+
+def pyramid_info(name, path):
+    """
+    Describes the DeepZoom pyramid of an image for the viewer.
+    Only the file header is read.
+    """
+    version = image_version(path)
+    width, height = _dimensions(path, version)
+    return {
+        'name': name,
+        'width': width,
+        'height': height,
+        'tile_size': TILE_SIZE,
+        'max_level': max_level(width, height),
+        'format': 'jpg',
+        'version': version,
+        'tile_url': f"/tiles/{name}/{{z}}/{{x}}_{{y}}.jpg?v={version}"
+    }
+
+
+def render_tile(path, version, level, col, row):
+    """
+    Renders one JPEG tile of the pyramid on demand.
+    `version` is part of the cache key so rewritten images are never served stale.
+    Raises OSError or ValueError if the image cannot be read (e.g. mid-rewrite).
+
+    Returns:
+        bytes: The encoded tile, or None if it lies outside the pyramid.
+    """
+    key = ('tile', path, version, level, col, row)
+    data = _cache.get(key)
+    if data is not None:
+        return data
+
+    width, height = _dimensions(path, version)
+    top = max_level(width, height)
+    if level < 0 or level > top or col < 0 or row < 0:
+        return None
+
+    reduction = top - level
+    level_bytes = math.ceil(width / 2 ** reduction) * math.ceil(height / 2 ** reduction) * 3
+    if reduction <= MAX_DECODE_REDUCTION and level_bytes > LEVEL_MAX_BYTES:
+        img = _level_band(path, version, level, top, row)
+        if img is None:
+            return None
+        y0 = 0
+    else:
+        img = _level_image(path, version, level, top)
+        y0 = row * TILE_SIZE
+    x0 = col * TILE_SIZE
+    if x0 >= img.shape[1] or y0 >= img.shape[0]:
+        return None
+
+    ok, encoded = cv2.imencode('.jpg', img[y0:y0 + TILE_SIZE, x0:x0 + TILE_SIZE],
+                               [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    if not ok:
+        raise ValueError(f"Unable to encode tile {level}/{col}_{row}")
+    data = encoded.tobytes()
+    _cache.put(key, data, len(data))
+    return data
@@ -0,0 +1,33 @@
+def iter_tiles(height, width, tile_size=256, margin=0):
+    """
+    Splits a frame into a grid of square tiles.
+
+    Yields (core, region) tuples as (x0, y0, x1, y1) in full-frame coordinates:
+    `core` is the tile itself and `region` is the tile grown by `margin` pixels
+    on every side, clipped to the frame. Detection runs on the region and keeps
+    only results centred in the core, so objects on tile borders are not lost.
+    """
+    for y0 in range(0, height, tile_size):
+        for x0 in range(0, width, tile_size):
+            x1 = min(x0 + tile_size, width)
+            y1 = min(y0 + tile_size, height)
+            core = (x0, y0, x1, y1)
+            region = (
+                max(x0 - margin, 0), max(y0 - margin, 0),
+                min(x1 + margin, width), min(y1 + margin, height)
+            )
+            yield core, region
+
+
+def tile_index(x, y, tile_size=256):
+    """
+    Returns the (column, row) of the tile containing a full-frame point.
+    """
+    return int(x) // tile_size, int(y) // tile_size
+
+
+def local_rect(rect, region):
+    """
+    Converts a full-frame rectangle into coordinates relative to `region`.
+    """
+    return (rect[0] - region[0], rect[1] - region[1], rect[2] - region[0], rect[3] - region[1])
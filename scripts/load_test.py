@@ -0,0 +1,352 @@
+"""
+Load-testing harness for the SOMA backend.
+
+Starts the app under gunicorn (the command from `procfile`), replays a weighted
+mix of /analyze uploads, report downloads and static artifact fetches at a
+fixed concurrency, and reports throughput, latency percentiles, error rates
+and server RSS over time. Throughput and latency only count successful
+requests; /analyze refusals while another analysis runs (503) are reported
+as busy and retried after their Retry-After, and artifacts missing while an
+analysis rewrites them (404) as missing.
+
+Examples:
+    python scripts/load_test.py --concurrency 4 --duration 120
+    python scripts/load_test.py --sizes 512x512:3,2048x2048:1 --gunicorn-args "--workers 2 --threads 4"
+    python scripts/load_test.py --url http://127.0.0.1:5000 --endpoints analyze:1
+"""
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import shlex
+import socket
+import argparse
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlparse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from modules.memory_budget import process_tree_mb
+
+STATIC_ARTIFACTS = [
+    '/static/preview.jpg',
+    '/static/boulders_detected.jpg',
+    '/static/landslides_detected.jpg',
+    '/static/clustered_boulders_plot.jpg',
+    '/static/risk_heatmap.jpg',
+    '/static/boulders_with_source.jpg',
+    '/static/boulder_points.json',
+]
+
+
+def parse_weights(spec):
+    """
+    Parses "a:3,b:1" into [('a', 3.0), ('b', 1.0)]. A missing weight means 1.
+    """
+    weights = []
+    for item in spec.split(','):
+        name, _, weight = item.strip().partition(':')
+        weights.append((name, float(weight or 1)))
+    return weights
+
+
+def synthetic_image(width, height, seed=0):
+    """
+    Builds a JPEG of grey regolith noise scattered with bright blobs, so the
+    detection stages do representative work.
+    """
+    rng = np.random.default_rng(seed)
+    img = rng.normal(90, 20, (height, width)).clip(0, 255).astype(np.uint8)
+    img = cv2.GaussianBlur(img, (5, 5), 0)
+    for _ in range(max(10, width * height // 20000)):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        cv2.circle(img, center, int(rng.integers(3, 30)), int(rng.integers(150, 255)), -1)
+    ok, encoded = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return encoded.tobytes()
+
+
+def multipart_body(field, filename, data):
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f"Content-Disposition: form-data; name=\"{field}\"; filename=\"{filename}\"\r\n"
+        f"Content-Type: image/jpeg\r\n\r\n"
+    ).encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(values)))
+    return values[rank - 1]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def procfile_command():
+    """
+    Reads the web command from the procfile, e.g. ['gunicorn', 'app:app'].
+    """
+    with open(os.path.join(ROOT, 'procfile'), 'r', encoding='utf-8') as f:
+        for line in f:
+            kind, _, command = line.partition(':')
+            if kind.strip() == 'web':
+                return shlex.split(command)
+    raise ValueError("No web process found in procfile")
+
+
+def start_server(port, extra_args):
+    command = procfile_command() + ['--bind', f'127.0.0.1:{port}'] + shlex.split(extra_args)
+    print(f"[🚀] Starting server: {' '.join(command)}")
+    process = subprocess.Popen(command, cwd=ROOT)
+
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Server did not start within 60s")
+
+
+class LoadTest:
+    def __init__(self, base_url, endpoints, images, concurrency, duration, max_requests, timeout):
+        parsed = urlparse(base_url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.endpoints = endpoints
+        self.images = images
+        self.concurrency = concurrency
+        self.duration = duration
+        self.max_requests = max_requests
+        self.timeout = timeout
+
+        self.image_data = {}
+        self.samples = []
+        self.lock = threading.Lock()
+        self.issued = 0
+
+    def _next_request(self):
+        with self.lock:
+            if self.max_requests and self.issued >= self.max_requests:
+                return None
+            self.issued += 1
+
+        names, weights = zip(*self.endpoints)
+        endpoint = random.choices(names, weights)[0]
+        if endpoint == 'analyze':
+            sizes, size_weights = zip(*self.images)
+            size = random.choices(sizes, size_weights)[0]
+            body, content_type = multipart_body('image', f'load_{size}.jpg', self.image_data[size])
+            return f'analyze[{size}]', 'POST', '/analyze', body, {'Content-Type': content_type}
+        if endpoint == 'report':
+            return 'report', 'GET', '/download-report', None, {}
+        return 'static', 'GET', random.choice(STATIC_ARTIFACTS), None, {}
+
+    def _worker(self, deadline):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        while time.time() < deadline:
+            request = self._next_request()
+            if request is None:
+                break
+            label, method, path, body, headers = request
+
+            start = time.perf_counter()
+            retry_after = 0
+            try:
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+                if label.startswith('analyze') and status == 503:
+                    # Only one analysis runs at a time; the others are refused at once
+                    outcome = 'busy'
+                    retry_after = response.getheader('Retry-After', '1')
+                    retry_after = float(retry_after) if retry_after.isdigit() else 1.0
+                # Artifacts are deleted while an analysis runs, so a missing one is not an error
+                elif not label.startswith('analyze') and status == 404:
+                    outcome = 'missing'
+                elif status < 400:
+                    outcome = 'ok'
+                else:
+                    outcome = 'error'
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                outcome, status = 'error', type(e).__name__
+            elapsed = time.perf_counter() - start
+
+            with self.lock:
+                self.samples.append((time.time(), label, elapsed, outcome, status))
+            if retry_after:
+                time.sleep(max(0.0, min(retry_after, deadline - time.time())))
+        connection.close()
+
+    def run(self):
+        self.image_data = {
+            size: synthetic_image(*map(int, size.split('x')), seed=i)
+            for i, (size, _) in enumerate(self.images)
+        }
+        deadline = time.time() + self.duration
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for _ in range(self.concurrency):
+                pool.submit(self._worker, deadline)
+        return self.samples
+
+
+def sample_rss(pid, interval, stop, timeline, start):
+    while not stop.is_set():
+        timeline.append((round(time.time() - start, 1), round(process_tree_mb(pid), 1)))
+        stop.wait(interval)
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def summarize(samples, started, finished, rss_timeline):
+    """
+    Aggregates raw samples into per-endpoint throughput, latency and error stats.
+    Throughput and latency percentiles count successful requests only, so
+    instant busy refusals, missing artifacts and errors do not inflate or hide them.
+    """
+    elapsed = max(finished - started, 1e-9)
+    groups = defaultdict(list)
+    for _, label, latency, outcome, status in samples:
+        groups[label].append((latency, outcome, status))
+        if label.startswith('analyze'):
+            groups['analyze (all)'].append((latency, outcome, status))
+
+    endpoints = {}
+    for label, rows in sorted(groups.items()):
+        latencies = sorted(latency for latency, outcome, _ in rows if outcome == 'ok')
+        errors = [status for _, outcome, status in rows if outcome == 'error']
+        busy = sum(1 for _, outcome, _ in rows if outcome == 'busy')
+        missing = sum(1 for _, outcome, _ in rows if outcome == 'missing')
+        endpoints[label] = {
+            'requests': len(rows),
+            'succeeded': len(latencies),
+            'throughput_per_min': round(len(latencies) / elapsed * 60, 1),
+            'busy': busy,
+            'missing': missing,
+            'error_rate': round(len(errors) / len(rows), 4),
+            'errors': {str(status): errors.count(status) for status in set(errors)},
+            'p50_ms': _ms(percentile(latencies, 50)),
+            'p95_ms': _ms(percentile(latencies, 95)),
+            'p99_ms': _ms(percentile(latencies, 99)),
+        }
+
+    return {
+        'duration_s': round(elapsed, 1),
+        'total_requests': len(samples),
+        'endpoints': endpoints,
+        'rss_mb': {
+            'max': max((mb for _, mb in rss_timeline), default=None),
+            'timeline': rss_timeline
+        }
+    }
+
+
+def print_report(report):
+    print(f"\n📊 Load test summary ({report['duration_s']} s, {report['total_requests']} requests)")
+    print("=" * 110)
+    print(f"{'endpoint':<24}{'requests':>9}{'ok':>8}{'ok/min':>10}{'busy':>8}{'missing':>9}{'errors':>9}"
+          f"{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}")
+    print("-" * 110)
+    for label, stats in report['endpoints'].items():
+        print(f"{label:<24}{stats['requests']:>9}{stats['succeeded']:>8}{stats['throughput_per_min']:>10}"
+              f"{stats['busy']:>8}{stats['missing']:>9}{stats['error_rate']:>9.1%}"
+              f"{str(stats['p50_ms']):>11}{str(stats['p95_ms']):>11}{str(stats['p99_ms']):>11}")
+        for status, count in stats['errors'].items():
+            print(f"{'':<24}  ↳ {count} x {status}")
+
+    timeline = report['rss_mb']['timeline']
+    if timeline:
+        print(f"\n🧠 Server RSS (max {report['rss_mb']['max']} MB)")
+        step = max(1, len(timeline) // 20)
+        for t, mb in timeline[::step]:
+            print(f"  t={t:>7}s  {mb:>8} MB  {'█' * int(mb / max(report['rss_mb']['max'], 1) * 40)}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help="Test an already running server instead of starting gunicorn")
+    parser.add_argument('--gunicorn-args', default='', help="Extra gunicorn arguments, e.g. \"--workers 2\"")
+    parser.add_argument('--sizes', default='718x523:3,2048x2048:1',
+                        help="Weighted image sizes for /analyze uploads (WxH:weight,...)")
+    parser.add_argument('--endpoints', default='analyze:2,report:1,static:4',
+                        help="Weighted request mix of analyze, report and static")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=60, help="Seconds to run")
+    parser.add_argument('--requests', type=int, default=0, help="Stop after this many requests (0 = no limit)")
+    parser.add_argument('--timeout', type=float, default=300, help="Per-request timeout in seconds")
+    parser.add_argument('--rss-interval', type=float, default=1.0, help="Seconds between RSS samples")
+    parser.add_argument('--json', help="Also write the full report to this file")
+    args = parser.parse_args(argv)
+
+    endpoints = parse_weights(args.endpoints)
+    unknown = {name for name, _ in endpoints} - {'analyze', 'report', 'static'}
+    if unknown:
+        parser.error(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+
+    server = None
+    base_url = args.url
+    if not base_url:
+        port = free_port()
+        server = start_server(port, args.gunicorn_args)
+        base_url = f'http://127.0.0.1:{port}'
+
+    stop = threading.Event()
+    rss_timeline = []
+    started = time.time()
+    if server is not None:
+        threading.Thread(
+            target=sample_rss, args=(server.pid, args.rss_interval, stop, rss_timeline, started), daemon=True
+        ).start()
+
+    try:
+        print(f"[🔥] {args.concurrency} concurrent clients against {base_url} for {args.duration}s")
+        test = LoadTest(base_url, endpoints, parse_weights(args.sizes), args.concurrency,
+                        args.duration, args.requests, args.timeout)
+        samples = test.run()
+        finished = time.time()
+    finally:
+        stop.set()
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    report = summarize(samples, started, finished, rss_timeline)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n[✅] Report written to: {args.json}")
+
+    return 1 if any(outcome == 'error' for _, _, _, outcome, _ in samples) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())